@@ -0,0 +1,98 @@
+import argparse
+import random
+from datetime import timedelta
+from string import ascii_uppercase
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db import tables, migrations
+from db.tables import User, Company, CompanyHistory, HeldStock, Position, CloseHistory, Symbol, Leaderboard
+from utils.scheduler import market_time
+
+STARTING_BALANCE = 10000
+CHUNK = 5000
+
+def make_tickers(count):
+    tickers = []
+    for i in range(count):
+        ticker = ''
+        for _ in range(4):
+            i, rem = divmod(i, 26)
+            ticker = ascii_uppercase[rem] + ticker
+        tickers.append(ticker)
+    return tickers
+
+def insert(db, model, rows):
+    for i in range(0, len(rows), CHUNK):
+        db.bulk_insert_mappings(model, rows[i:i + CHUNK])
+
+def generate(db, companies=100, lots=1000, symbols=200, history=120, seed=0):
+    """Fill an empty database with synthetic players, lots and hourly history.
+    Returns a map of company id -> symbols it holds."""
+    rng = random.Random(seed)
+    now = market_time().replace(minute=0, second=0, microsecond=0)
+    tickers = make_tickers(symbols)
+    insert(db, Symbol, [dict(symbol=t, name=f'{t} Holdings Inc', stock_type='cs', active=True) for t in tickers])
+
+    # hourly close history as a random walk per symbol
+    prices = {t: rng.uniform(5, 500) for t in tickers}
+    closes = []
+    for hour in range(history, 0, -1):
+        date = now - timedelta(hours=hour)
+        for t in tickers:
+            prices[t] *= 1 + rng.gauss(0, 0.01)
+            closes.append(dict(symbol=t, date=date, close=round(prices[t], 2), volume=rng.randint(10_000, 5_000_000)))
+    insert(db, CloseHistory, closes)
+
+    insert(db, User, [dict(id=str(1000 + i), credit_score=0) for i in range(companies)])
+    insert(db, Company, [dict(id=i + 1, owner=str(1000 + i), name=f'Company {i}', balance=STARTING_BALANCE, active=True) for i in range(companies)])
+
+    held = {}
+    positions = {}
+    rows = []
+    for _ in range(lots):
+        company = rng.randint(1, companies)
+        symbol = rng.choice(tickers)
+        quantity = rng.randint(1, 50)
+        price = round(prices[symbol] * rng.uniform(0.8, 1.2), 2)
+        rows.append(dict(symbol=symbol, quantity=quantity, company=company, purchase_price=price,
+            purchase_date=now - timedelta(hours=rng.randint(1, max(history, 1)))))
+        held.setdefault(company, set()).add(symbol)
+        position = positions.setdefault((company, symbol), dict(company=company, symbol=symbol, quantity=0, cost_basis=0.0, lots=0))
+        position['quantity'] += quantity
+        position['cost_basis'] += quantity * price
+        position['lots'] += 1
+    insert(db, HeldStock, rows)
+    insert(db, Position, list(positions.values()))
+
+    worth = {}
+    history_rows = []
+    for company in range(1, companies + 1):
+        value = STARTING_BALANCE
+        for hour in range(history, 0, -1):
+            value *= 1 + rng.gauss(0, 0.005)
+            history_rows.append(dict(company=company, date=now - timedelta(hours=hour), value=value))
+        worth[company] = value
+    insert(db, CompanyHistory, history_rows)
+    ranked = sorted(worth.items(), key=lambda item: item[1], reverse=True)
+    insert(db, Leaderboard, [dict(company=c, value=v, rank=r, date=now) for r, (c, v) in enumerate(ranked, 1)])
+    return {company: sorted(symbols) for company, symbols in held.items()}
+
+def create(engine):
+    tables.Base.metadata.create_all(bind=engine)
+    migrations.stamp(engine)
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Fill a stonks database with synthetic data.')
+    parser.add_argument('dbfile')
+    parser.add_argument('--companies', type=int, default=100)
+    parser.add_argument('--lots', type=int, default=1000)
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--history', type=int, default=120, help='hours of close and net worth history')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    engine = create_engine('sqlite:///' + args.dbfile)
+    create(engine)
+    db = sessionmaker(bind=engine)()
+    generate(db, args.companies, args.lots, args.symbols, args.history, args.seed)
+    db.commit()
+    print(f"{args.dbfile} filled.")
@@ -0,0 +1,21 @@
+class FakeUser:
+    def __init__(self, id, name=None):
+        self.id = id
+        self.name = name or f'user{id}'
+
+class FakeContext:
+    """Minimal stand-in for a discord.ext.commands.Context that records what the bot sends."""
+    def __init__(self, author):
+        self.author = author
+        self.command = None
+        self.sent = []
+
+    async def send(self, content=None, *, embed=None, file=None):
+        self.sent.append(content if content is not None else embed or file)
+
+    async def send_help(self, *args):
+        self.sent.append('help')
+
+async def invoke(cog, command, ctx, *args):
+    """Run a cog command callback the way the bot would, without discord's dispatcher."""
+    return await getattr(cog, command).callback(cog, ctx, *args)
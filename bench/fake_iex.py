@@ -0,0 +1,130 @@
+import argparse
+import json
+import random
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from datetime import timedelta
+from utils.scheduler import market_time
+
+class FakeExchange:
+    """Synthetic stand-in for the IEX API with a configurable per-request latency. See serve() to put it behind http."""
+    def __init__(self, latency=0.05, split_ratio=0.02, dividend_ratio=0.05, seed=0):
+        self.latency = latency
+        self.split_ratio = split_ratio
+        self.dividend_ratio = dividend_ratio
+        self.seed = seed
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.symbols = []
+        self.rng = random.Random(seed)
+
+    def request(self):
+        with self.lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def _rng(self, symbol, salt=''):
+        return random.Random(zlib.crc32(f'{self.seed}{salt}{symbol}'.encode()))
+
+    def base_price(self, symbol):
+        return round(self._rng(symbol).uniform(5, 500), 2)
+
+    def quote(self, symbol):
+        # drift slowly with wall time so consecutive evaluations see price changes
+        price = round(self.base_price(symbol) * (1 + 0.01 * self._rng(symbol, int(time.time() // 60)).uniform(-1, 1)), 2)
+        volume = self._rng(symbol, 'volume').randint(10_000, 5_000_000)
+        return {
+            'symbol': symbol,
+            'latestPrice': price,
+            'latestVolume': volume,
+            'close': price,
+            'volume': volume,
+            'previousClose': self.base_price(symbol),
+            'previousVolume': volume}
+
+    def splits(self, symbol):
+        if self._rng(symbol, 'split').random() >= self.split_ratio:
+            return []
+        return [{'exDate': market_time().date().isoformat(), 'fromFactor': 1, 'toFactor': 2}]
+
+    def dividends(self, symbol):
+        if self._rng(symbol, 'dividend').random() >= self.dividend_ratio:
+            return []
+        today = market_time().date()
+        return [{
+            'paymentDate': today.isoformat(),
+            'exDate': (today - timedelta(days=14)).isoformat(),
+            'amount': round(self._rng(symbol, 'amount').uniform(0.05, 2), 2)}]
+
+    def listing(self):
+        return [{'symbol': s, 'name': f'{s} Holdings Inc', 'type': 'cs', 'isEnabled': True} for s in self.symbols]
+
+def make_handler(exchange, error_rate=0.0):
+    class ExchangeHandler(BaseHTTPRequestHandler):
+        """Serves the quote, batch and symbols endpoints of the IEX cloud API from a FakeExchange.
+        A share of requests, set by error_rate, fails with a 429 or 503 to exercise retries."""
+        def do_GET(self):
+            url = urlparse(self.path)
+            query = parse_qs(url.query)
+            parts = url.path.strip('/').split('/')
+            exchange.request()
+            if exchange.rng.random() < error_rate:
+                self._send(exchange.rng.choice([429, 503]), {'error': 'injected'}, credits=0)
+                return
+            if parts[-3:-1] == ['stock', 'market'] and parts[-1] == 'batch':
+                symbols = query.get('symbols', [''])[0].split(',')
+                types = query.get('types', [''])[0].split(',')
+                endpoints = {'quote': exchange.quote, 'splits': exchange.splits, 'dividends': exchange.dividends}
+                if not all(endpoint in endpoints for endpoint in types):
+                    self._send(400, {'error': 'unknown type'})
+                    return
+                self._send(200, {symbol: {endpoint: endpoints[endpoint](symbol) for endpoint in types} for symbol in symbols if symbol}, credits=len(symbols))
+            elif len(parts) >= 3 and parts[-3] == 'stock' and parts[-1] == 'quote':
+                self._send(200, exchange.quote(parts[-2]))
+            elif parts[-2:] == ['ref-data', 'symbols']:
+                self._send(200, exchange.listing(), credits=100)
+            else:
+                self._send(404, {'error': 'not found'})
+
+        def _send(self, status, body, credits=1):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.send_header('iexcloud-messages-used', str(credits))
+            if status == 429:
+                self.send_header('Retry-After', '0')
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+    return ExchangeHandler
+
+def serve(exchange, port=0, error_rate=0.0):
+    """Serve the fake exchange over http in a background thread. Returns the server and its base url."""
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(exchange, error_rate))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://127.0.0.1:{server.server_address[1]}'
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the IEX cloud API.')
+    parser.add_argument('--port', type=int, default=8766)
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--latency', type=float, default=50, help='per request latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of requests answered with a 429 or 503')
+    args = parser.parse_args()
+    from .datagen import make_tickers
+    exchange = FakeExchange(latency=args.latency / 1000)
+    exchange.symbols = make_tickers(args.symbols)
+    server, url = serve(exchange, args.port, args.error_rate)
+    print(f"serving the exchange on {url}, set [exchange] base_url to it")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
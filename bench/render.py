@@ -0,0 +1,83 @@
+import argparse
+import json
+import random
+import subprocess
+import sys
+import time
+from modules import render
+from .datagen import make_tickers
+
+STARTUP_SCRIPT = """
+import sys, time
+start = time.perf_counter()
+import modules.stonks
+print(time.perf_counter() - start)
+print(','.join(name for name in ('pandas', 'numpy', 'iexfinance') if name in sys.modules))
+"""
+
+def startup(runs):
+    """Cold import time of the cog in a fresh interpreter, and which heavy modules it loaded."""
+    samples, loaded = [], ''
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, '-c', STARTUP_SCRIPT], capture_output=True, text=True, check=True).stdout.split('\n')
+        samples.append(float(output[0]))
+        loaded = output[1]
+    return {'seconds': min(samples), 'heavy_modules': loaded.split(',') if loaded else []}
+
+def pandas_daily(lots):
+    """The dataframe implementation daily used before, kept unchanged as a reference for the output."""
+    import pandas as pd
+    import numpy as np
+    from tabulate import tabulate
+    inventory = [[symbol, quantity, purchase_price, close, quantity*close - quantity*purchase_price] for symbol, quantity, purchase_price, close in lots]
+    inv_df = pd.DataFrame(inventory, columns=['Symbol', 'Quantity', 'Purchase Price', 'Close', 'Current Value'])
+    inv_df['sign'] = np.where(inv_df['Current Value']>=0, '+', '-')
+    inv_df['%'] = abs(((inv_df['Close'] - inv_df['Purchase Price'])  / inv_df['Purchase Price']) * 100)
+    inv_df['%'] = inv_df['%'].round(1)
+    inv_df = inv_df.sort_values(['Symbol'])
+    inv_df = inv_df[['sign', '%', 'Symbol', 'Quantity', 'Purchase Price', 'Close', 'Current Value']]
+    aggregated = tabulate(inv_df.values.tolist(), headers=['Δ', '%', 'Symbol', 'Quantity', 'Purchase Price', 'Close', 'Current Value'])
+    return f'```diff\n{aggregated}```'
+
+def make_lots(rng, count, symbols):
+    tickers = make_tickers(symbols)
+    return [[rng.choice(tickers), rng.randint(1, 500), round(rng.uniform(1, 500), 2), round(rng.uniform(1, 500), 2)] for _ in range(count)]
+
+def timed(func, *args, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(*args)
+    return (time.perf_counter() - start) / repeat * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description='Startup and table render benchmarks.')
+    parser.add_argument('--rows', type=int, default=50, help='lots per rendered table')
+    parser.add_argument('--symbols', type=int, default=20)
+    parser.add_argument('--repeat', type=int, default=200)
+    parser.add_argument('--startup-runs', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    lots = make_lots(rng, args.rows, args.symbols)
+    positions = [[symbol, quantity, quantity * close] for symbol, quantity, _, close in lots]
+    scores = [[i, f'company{i}', round(rng.uniform(0, 50000), 2), rng.choice(['⮝1', '⮟1', ''])] for i in range(1, 11)]
+    results = {
+        'params': vars(args),
+        'startup': startup(args.startup_runs),
+        'render_ms': {
+            'inv': timed(render.inv_table, positions, repeat=args.repeat),
+            'daily': timed(render.daily_table, lots, repeat=args.repeat),
+            'score': timed(render.score_table, scores, 1, 1, repeat=args.repeat)}}
+    try:
+        results['render_ms']['daily_pandas'] = timed(pandas_daily, lots, repeat=args.repeat)
+        reference, table = pandas_daily(lots), render.daily_table(lots)
+        results['daily_identical'] = reference == table
+        # the reference sort is unstable, so lots of one symbol may come out in another order
+        results['daily_same_rows'] = sorted(reference.split('\n')) == sorted(table.split('\n'))
+    except ImportError:
+        results['daily_identical'] = results['daily_same_rows'] = None
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from db.tables import CloseHistory
+
+class SyntheticSource:
+    """Random walk ticks for any symbol."""
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.prices = {}
+
+    def ticks(self, symbols):
+        while True:
+            with self.lock:
+                batch = []
+                for symbol in symbols:
+                    price = self.prices.get(symbol) or self.rng.uniform(5, 500)
+                    self.prices[symbol] = price * (1 + self.rng.gauss(0, 0.001))
+                    batch.append({'symbol': symbol, 'latestPrice': round(self.prices[symbol], 2), 'latestVolume': self.rng.randint(10_000, 5_000_000)})
+            yield batch
+
+class HistorySource:
+    """Replays recorded CloseHistory rows of a stonks database in date order."""
+    def __init__(self, dbfile):
+        self.session = sessionmaker(bind=create_engine('sqlite:///' + dbfile))
+
+    def ticks(self, symbols):
+        db = self.session()
+        try:
+            rows = db.query(CloseHistory).filter(CloseHistory.symbol.in_(symbols)).order_by(CloseHistory.date).yield_per(1000)
+            batch, date = [], None
+            for row in rows:
+                if date is not None and row.date != date:
+                    yield batch
+                    batch = []
+                date = row.date
+                batch.append({'symbol': row.symbol, 'latestPrice': row.close, 'latestVolume': row.volume})
+            if batch:
+                yield batch
+        finally:
+            db.close()
+
+def make_handler(source, interval):
+    class FeedHandler(BaseHTTPRequestHandler):
+        """Serves ticks for ?symbols=A,B as an IEX style server-sent event stream."""
+        def do_GET(self):
+            symbols = [s for s in parse_qs(urlparse(self.path).query).get('symbols', [''])[0].split(',') if s]
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Cache-Control', 'no-cache')
+            self.end_headers()
+            try:
+                for batch in source.ticks(symbols):
+                    self.wfile.write(f'data: {json.dumps(batch)}\n\n'.encode())
+                    self.wfile.flush()
+                    time.sleep(interval)
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+
+        def log_message(self, *args):
+            pass
+    return FeedHandler
+
+def serve(port=8765, dbfile=None, interval=0.5, seed=0):
+    """Start the replay feed in a background thread. Returns the server; call shutdown() to stop it."""
+    source = HistorySource(dbfile) if dbfile else SyntheticSource(seed)
+    server = ThreadingHTTPServer(('127.0.0.1', port), make_handler(source, interval))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Local stand-in for the IEX SSE price feed.')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--db', help='replay CloseHistory from this database instead of synthetic ticks')
+    parser.add_argument('--interval', type=float, default=0.5, help='seconds between tick batches')
+    args = parser.parse_args()
+    server = serve(args.port, args.db, args.interval)
+    print(f"serving ticks on http://127.0.0.1:{args.port}/, set [stream] url to it")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
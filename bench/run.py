@@ -0,0 +1,142 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from utils import config
+from db import interface
+from . import datagen, fake_iex
+from .fake_ctx import FakeContext, FakeUser, invoke
+
+COMMANDS = ['buy', 'sell', 'inv', 'daily', 'score', 'balance']
+
+class QueryCounter:
+    def __init__(self, *engines):
+        self.lock = threading.Lock()
+        self.count = 0
+        for engine in engines:
+            event.listen(engine, 'before_cursor_execute', self._count)
+
+    def _count(self, *args):
+        with self.lock:
+            self.count += 1
+
+def percentile(samples, p):
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))]
+
+class Scenario:
+    """Measures wall time, database queries and exchange requests of a block of work."""
+    def __init__(self, queries, exchange):
+        self.queries = queries
+        self.exchange = exchange
+
+    def __enter__(self):
+        self.result = {}
+        self.start = time.perf_counter()
+        self.start_queries = self.queries.count
+        self.start_requests = self.exchange.requests
+        return self.result
+
+    def __exit__(self, type, value, traceback):
+        self.result['seconds'] = time.perf_counter() - self.start
+        self.result['queries'] = self.queries.count - self.start_queries
+        self.result['exchange_requests'] = self.exchange.requests - self.start_requests
+
+async def run_commands(cog, holdings, users, per_user, rng):
+    from modules.stonks import StonksError
+    latencies = []
+    errors = 0
+    async def user_session(company_id):
+        nonlocal errors
+        ctx = FakeContext(FakeUser(999 + company_id))
+        symbols = holdings.get(company_id) or ['AAAA']
+        for _ in range(per_user):
+            command = rng.choice(COMMANDS)
+            args = (1, rng.choice(symbols)) if command in ('buy', 'sell') else ()
+            start = time.perf_counter()
+            try:
+                await invoke(cog, command, ctx, *args)
+            except StonksError:
+                pass
+            except Exception:
+                errors += 1
+            latencies.append(time.perf_counter() - start)
+    await asyncio.gather(*[user_session(company_id) for company_id in range(1, users + 1)])
+    return latencies, errors
+
+def main():
+    parser = argparse.ArgumentParser(description='Offline stonks benchmarks against a fake exchange.')
+    parser.add_argument('--companies', type=int, default=100)
+    parser.add_argument('--lots', type=int, default=1000)
+    parser.add_argument('--symbols', type=int, default=200)
+    parser.add_argument('--history', type=int, default=120, help='hours of close and net worth history')
+    parser.add_argument('--users', type=int, default=20, help='concurrent command sessions')
+    parser.add_argument('--commands', type=int, default=10, help='commands per session')
+    parser.add_argument('--latency', type=float, default=50, help='fake exchange latency in ms')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='share of fake exchange requests failing with a 429 or 503')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--db-url', help='benchmark an empty database at this url, e.g. a local postgres, instead of a scratch sqlite file')
+    parser.add_argument('--output', help='write results as JSON to this file instead of stdout')
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    # the exchange client talks to a local fake of the iex api
+    exchange = fake_iex.FakeExchange(latency=args.latency / 1000, seed=args.seed)
+    exchange.symbols = datagen.make_tickers(args.symbols)
+    server, url = fake_iex.serve(exchange, error_rate=args.error_rate)
+
+    workdir = tempfile.mkdtemp(prefix='stonks-bench-')
+    config.config_file = os.path.join(workdir, 'config.ini')
+    with open(config.config_file, 'w') as file:
+        file.write(f'[iex]\ntoken = bench\n\n[exchange]\nbase_url = {url}\nbackoff = 0.05\n')
+
+    # point the shared session at a scratch database
+    engine = interface.bind(args.db_url or 'sqlite:///' + os.path.join(workdir, 'stonks.db'))
+    datagen.create(engine)
+    db = sessionmaker(bind=engine)()
+    holdings = datagen.generate(db, args.companies, args.lots, args.symbols, args.history, args.seed)
+    db.commit()
+    db.close()
+
+    from modules import stonks
+    from modules.iex import Iex
+    stonks.market_open_status = lambda: True
+    queries = QueryCounter(engine, interface.read_engine)
+    results = {'params': vars(args), 'scenarios': {}}
+
+    cog = stonks.Stonks(None)
+    with Scenario(queries, exchange) as result:
+        latencies, errors = asyncio.run(run_commands(cog, holdings, min(args.users, args.companies), args.commands, rng))
+    result.update({
+        'commands': len(latencies),
+        'errors': errors,
+        'commands_per_second': len(latencies) / result['seconds'] if result['seconds'] else None,
+        'latency_ms': {p: percentile(latencies, int(p[1:])) * 1000 for p in ('p50', 'p95', 'p99')}})
+    results['scenarios']['commands'] = result
+
+    iex = Iex()
+    for job in ('evaluate', 'splits', 'dividends'):
+        with Scenario(queries, exchange) as result:
+            getattr(iex, job)()
+        results['scenarios'][job] = result
+
+    results['exchange'] = iex.exchange.stats()
+    server.shutdown()
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, 'w') as file:
+            file.write(output)
+    else:
+        print(output)
+
+if __name__ == '__main__':
+    main()
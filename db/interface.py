@@ -1,8 +1,66 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event
 from sqlalchemy.orm import sessionmaker, scoped_session
+from utils import config, metrics
 
-engine = create_engine('sqlite:///stonks.db')
+DEFAULT_URL = 'sqlite:///stonks.db'
+
+def _sqlite_engine(url, conf, read_only):
+    busy_timeout = conf.getfloat('busy_timeout', fallback=30)
+    engine = create_engine(url, connect_args={'timeout': busy_timeout, 'check_same_thread': False})
+    pragmas = {
+        # WAL lets readers run alongside the single writer instead of failing with "database is locked"
+        'journal_mode': conf.get('journal_mode', fallback='WAL'),
+        'synchronous': conf.get('synchronous', fallback='NORMAL'),
+        'busy_timeout': int(busy_timeout * 1000),
+        'cache_size': -conf.getint('cache_size_kb', fallback=20000),
+        'temp_store': 'MEMORY'}
+    if read_only:
+        pragmas['query_only'] = 'ON'
+
+    @event.listens_for(engine, 'connect')
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+    return engine
+
+def make_engine(url=None, read_only=False):
+    """Create an engine tuned by the [database] section of config.ini.
+    The url comes from the STONKS_DB_URL environment variable, then the config, then defaults to stonks.db."""
+    conf = config.load('database', required=False)
+    url = url or os.environ.get('STONKS_DB_URL') or conf.get('url', fallback=DEFAULT_URL)
+    if url.startswith('sqlite'):
+        engine = _sqlite_engine(url, conf, read_only)
+    else:
+        engine = create_engine(url,
+            pool_size=conf.getint('pool_size', fallback=5),
+            max_overflow=conf.getint('max_overflow', fallback=10),
+            pool_timeout=conf.getfloat('pool_timeout', fallback=30),
+            pool_recycle=conf.getint('pool_recycle', fallback=1800),
+            pool_pre_ping=True)
+        if read_only:
+            engine = engine.execution_options(postgresql_readonly=True)
+    metrics.instrument_engine(engine)
+    return engine
+
+engine = make_engine()
+read_engine = make_engine(read_only=True)
 Session = scoped_session(sessionmaker(bind=engine))
+# display commands read through their own sessions, which never flush or commit
+ReadSession = scoped_session(sessionmaker(bind=read_engine, autoflush=False))
+
+def bind(url):
+    """Point the shared sessions at another database, for tools and benchmarks."""
+    global engine, read_engine
+    Session.remove()
+    ReadSession.remove()
+    engine = make_engine(url)
+    read_engine = make_engine(url, read_only=True)
+    Session.configure(bind=engine)
+    ReadSession.configure(bind=read_engine)
+    return engine
 
 class DB:
     def __enter__(self):
@@ -14,5 +72,13 @@ class DB:
         #self.sess.close()
         Session.remove()
 
+class ReadDB:
+    """Like DB, but read only. Anything added to the session is discarded."""
+    def __enter__(self):
+        return ReadSession()
+    def __exit__(self, type, value, traceback):
+        ReadSession.rollback()
+        ReadSession.remove()
+
 def _list(list_of_tuples):
     return [v for (v,) in list_of_tuples]
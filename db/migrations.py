@@ -0,0 +1,101 @@
+from datetime import datetime
+from sqlalchemy import func, select, and_, text
+from db import tables
+from db.tables import SchemaVersion
+
+# Each migration upgrades an existing database by one version.
+# Append new migrations to the end of the list; never reorder or edit applied ones.
+
+def create_indexes(conn, *models):
+    for model in models:
+        for index in model.__table__.indexes:
+            index.create(bind=conn, checkfirst=True)
+
+def add_lookup_indexes(conn):
+    create_indexes(conn, tables.Company, tables.CompanyHistory, tables.HeldStock, tables.CloseHistory)
+
+def add_leaderboard(conn):
+    tables.Leaderboard.__table__.create(bind=conn, checkfirst=True)
+    # backfill from the latest history row of every active company
+    history = tables.CompanyHistory.__table__
+    companies = tables.Company.__table__
+    latest = select([history.c.company, func.max(history.c.date).label('date')]).group_by(history.c.company).alias('latest')
+    rows = conn.execute(select([history.c.company, history.c.value, history.c.date])
+        .select_from(history
+            .join(latest, and_(history.c.company == latest.c.company, history.c.date == latest.c.date))
+            .join(companies, companies.c.id == history.c.company))
+        .where(companies.c.active == True)
+        .order_by(history.c.value.desc())).fetchall()
+    entries = {}
+    for company, value, date in rows:
+        entries.setdefault(company, dict(company=company, value=value, rank=len(entries) + 1, date=date))
+    if entries:
+        conn.execute(tables.Leaderboard.__table__.insert(), list(entries.values()))
+
+def add_symbol_active(conn):
+    conn.execute(text("ALTER TABLE symbols ADD COLUMN active BOOLEAN"))
+    conn.execute(tables.Symbol.__table__.update().values(active=True))
+
+def add_positions(conn):
+    tables.Position.__table__.create(bind=conn, checkfirst=True)
+    lots = tables.HeldStock.__table__
+    aggregated = select([lots.c.company, lots.c.symbol, func.sum(lots.c.quantity), func.sum(lots.c.quantity * lots.c.purchase_price), func.count()])\
+        .where(lots.c.quantity > 0).group_by(lots.c.company, lots.c.symbol)
+    positions = tables.Position.__table__
+    conn.execute(positions.insert().from_select(['company', 'symbol', 'quantity', 'cost_basis', 'lots'], aggregated))
+
+def add_standing_orders(conn):
+    tables.StandingOrder.__table__.create(bind=conn, checkfirst=True)
+
+def add_rollups(conn):
+    tables.SymbolRollup.__table__.create(bind=conn, checkfirst=True)
+    tables.CompanyRollup.__table__.create(bind=conn, checkfirst=True)
+
+MIGRATIONS = [
+    (1, 'composite indexes for hot lookup paths', add_lookup_indexes),
+    (2, 'materialized leaderboard', add_leaderboard),
+    (3, 'symbols active flag', add_symbol_active),
+    (4, 'aggregated positions', add_positions),
+    (5, 'limit and stop orders', add_standing_orders),
+    (6, 'history rollups', add_rollups),
+]
+
+def latest_version():
+    return MIGRATIONS[-1][0] if MIGRATIONS else 0
+
+def current_version(conn):
+    version = conn.execute(func.max(SchemaVersion.__table__.c.version).select()).scalar()
+    return version or 0
+
+def _record(conn, version, description):
+    conn.execute(SchemaVersion.__table__.insert().values(version=version, description=description, applied=datetime.utcnow()))
+
+def stamp(engine):
+    """Mark a freshly created schema as up to date without running migrations."""
+    SchemaVersion.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        current = current_version(conn)
+        for version, description, _ in MIGRATIONS:
+            if version > current:
+                _record(conn, version, description)
+
+def upgrade(engine):
+    """Apply all pending migrations in order, each in its own transaction. Returns the number applied."""
+    SchemaVersion.__table__.create(bind=engine, checkfirst=True)
+    with engine.begin() as conn:
+        current = current_version(conn)
+    applied = 0
+    for version, description, migrate in MIGRATIONS:
+        if version <= current:
+            continue
+        with engine.begin() as conn:
+            migrate(conn)
+            _record(conn, version, description)
+        print(f"applied migration {version}: {description}")
+        applied += 1
+    return applied
+
+if __name__ == '__main__':
+    from db.interface import engine
+    count = upgrade(engine)
+    print(f"database at version {latest_version()}, {count} migrations applied.")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, Sequence, ForeignKey
+from sqlalchemy import Column, Integer, Float, String, Boolean, DateTime, Sequence, ForeignKey, Index
 from sqlalchemy.ext.declarative import declarative_base
 
 Base = declarative_base()
@@ -15,6 +15,7 @@ class Company(Base):
     name = Column(String(30))
     balance = Column(Float)
     active = Column(Boolean)
+    __table_args__ = (Index('ix_companies_owner_active', 'owner', 'active'),)
 
 class CompanyHistory(Base):
     __tablename__ = 'company_history'
@@ -22,6 +23,8 @@ class CompanyHistory(Base):
     company = Column(Integer, ForeignKey('companies.id'), nullable=False)
     date = Column(DateTime)
     value = Column(Float)
+    # ascending indexes are scanned backwards for order_by(date.desc())
+    __table_args__ = (Index('ix_company_history_company_date', 'company', 'date'),)
 
 class HeldStock(Base):
     __tablename__ = 'held_stock'
@@ -31,6 +34,19 @@ class HeldStock(Base):
     company = Column(Integer, ForeignKey('companies.id'), nullable=False)
     purchase_price = Column(Float)
     purchase_date = Column(DateTime)
+    __table_args__ = (Index('ix_held_stock_company_symbol', 'company', 'symbol'),)
+
+class Position(Base):
+    # per (company, symbol) summary of held_stock lots, maintained by Iex.buy and Iex.sell
+    # the lots remain the source of truth for FIFO selling and dividend eligibility
+    __tablename__ = 'positions'
+    company = Column(Integer, ForeignKey('companies.id'), primary_key=True)
+    symbol = Column(String(6), primary_key=True)
+    quantity = Column(Integer)
+    # total purchase cost of the remaining lots
+    cost_basis = Column(Float)
+    lots = Column(Integer)
+    __table_args__ = (Index('ix_positions_symbol', 'symbol'),)
 
 class CloseHistory(Base):
     __tablename__ = 'close_history'
@@ -39,12 +55,15 @@ class CloseHistory(Base):
     date = Column(DateTime)
     close = Column(Float)
     volume = Column(Integer)
+    __table_args__ = (Index('ix_close_history_symbol_date', 'symbol', 'date'),)
 
 class Symbol(Base):
     __tablename__= 'symbols'
     symbol = Column(String(6), primary_key=True)
     name = Column(String(50))
     stock_type = Column(String(5))
+    # delisted symbols are kept but marked inactive
+    active = Column(Boolean, default=True)
 
 class Transaction(Base):
     # Transaction types are classified as the following:
@@ -59,3 +78,65 @@ class Transaction(Base):
     trans_volume = Column(Integer)
     trans_price = Column(Float)
     date = Column(DateTime)
+
+class Leaderboard(Base):
+    # latest net worth of every active company, kept up to date by Iex.evaluate and $register
+    # rank is as of the last evaluation, previous_rank as of the one before it
+    __tablename__ = 'leaderboard'
+    company = Column(Integer, ForeignKey('companies.id'), primary_key=True)
+    value = Column(Float)
+    rank = Column(Integer)
+    previous_rank = Column(Integer)
+    date = Column(DateTime)
+    __table_args__ = (Index('ix_leaderboard_value', 'value'),)
+
+class StandingOrder(Base):
+    # limit and stop orders waiting for their trigger price, see modules/triggers.py
+    # side is 'buy' or 'sell', kind is 'limit' or 'stop'
+    # status is one of 'open', 'filled', 'rejected', 'cancelled' or 'expired'
+    __tablename__ = 'standing_orders'
+    id = Column(Integer, primary_key=True)
+    company = Column(Integer, ForeignKey('companies.id'), nullable=False)
+    symbol = Column(String(6))
+    side = Column(String(4))
+    kind = Column(String(5))
+    quantity = Column(Integer)
+    price = Column(Float)
+    status = Column(String(10))
+    created = Column(DateTime)
+    expires = Column(DateTime)
+    fill_price = Column(Float)
+    filled = Column(DateTime)
+    __table_args__ = (
+        Index('ix_standing_orders_status_symbol', 'status', 'symbol'),
+        Index('ix_standing_orders_company_status', 'company', 'status'))
+
+class SymbolRollup(Base):
+    # daily ('D') and weekly ('W') aggregates of close_history, see modules/rollups.py
+    __tablename__ = 'symbol_rollups'
+    symbol = Column(String(6), primary_key=True)
+    period = Column(String(1), primary_key=True)
+    start = Column(DateTime, primary_key=True)
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+    volume = Column(Integer)
+
+class CompanyRollup(Base):
+    # daily ('D') aggregates of company_history net worth, see modules/rollups.py
+    __tablename__ = 'company_rollups'
+    company = Column(Integer, ForeignKey('companies.id'), primary_key=True)
+    period = Column(String(1), primary_key=True)
+    start = Column(DateTime, primary_key=True)
+    open = Column(Float)
+    high = Column(Float)
+    low = Column(Float)
+    close = Column(Float)
+
+class SchemaVersion(Base):
+    # applied migrations, see db/migrations.py
+    __tablename__ = 'schema_version'
+    version = Column(Integer, primary_key=True)
+    description = Column(String(100))
+    applied = Column(DateTime)
@@ -1,18 +1,19 @@
-import os
-from db import tables
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from db import tables, migrations
+from db.interface import engine
+from sqlalchemy import inspect
 from modules.iex import Iex
 
-dbfile = 'stonks.db'
+# the database is configured in the [database] section of config.ini
+dbname = engine.url.database
 
-if not os.path.isfile(dbfile):
-    engine = create_engine('sqlite:///' + dbfile)
+if not inspect(engine).has_table(tables.Company.__tablename__):
     tables.Base.metadata.bind = engine
     tables.Base.metadata.create_all()
-    print(f"{dbfile} created.")
+    migrations.stamp(engine)
+    print(f"{dbname} created.")
 else:
-    print(f"{dbfile} already exists, no changes made.")
+    applied = migrations.upgrade(engine)
+    print(f"{dbname} already exists, {applied} migrations applied.")
 
 populate = input("Populate symbols table? [y/n]")
 if populate=="y" or "Y":
@@ -1,8 +1,11 @@
 import discord
 from discord.ext import commands
-from utils import config
-from utils.scheduler import Scheduler, next_daily_data, next_market_hour
+from utils import config, metrics
+from utils.scheduler import get_scheduler, next_daily_data, next_market_hour, next_market_open, next_minute
 from modules.iex import Iex
+from modules.rollups import get_rollups
+from modules.archive import get_archive
+from modules.executor import get_executor
 
 # Configs
 discord_token = config.load('discord').get('token')
@@ -20,12 +23,28 @@ for extension in startup_extensions:
         exc = '{}: {}'.format(type(e).__name__, e)
         print('Failed to load extension {}\n{}'.format(extension, exc))
 
+# Streaming prices
+if iex.stream:
+    iex.stream.add_listener(lambda symbol, price: iex.book.on_prices({symbol: price}))
+    iex.stream.start()
+
 # Scheduler
-sched = Scheduler()
-sched.schedule(iex.evaluate, next_market_hour)
+sched = get_scheduler()
+sched.schedule(iex.evaluate, next_market_hour, timeout=3600)
 sched.schedule(iex.splits, next_daily_data)
 sched.schedule(iex.dividends, next_daily_data)
+sched.schedule(iex.update_symbols, next_daily_data)
+sched.schedule(iex.book.expire, next_market_open)
+sched.schedule(get_rollups().rollup, next_daily_data)
+sched.schedule(get_archive().archive, next_daily_data)
+if config.load('metrics', required=False).get('textfile'):
+    sched.schedule(metrics.write_textfile, next_minute)
 sched.start()
 
 # Run
-bot.run(discord_token)
\ No newline at end of file
+bot.run(discord_token)
+
+# Shutdown, writing out any buffered ticks
+if iex.stream:
+    iex.stream.stop()
+get_executor().shutdown()
\ No newline at end of file
@@ -0,0 +1,186 @@
+import gzip
+import io
+import json
+import os
+import re
+import threading
+import time as time_t
+from datetime import datetime, time, timedelta
+from sqlalchemy import DateTime, Float, Integer
+from db.interface import DB
+from db.tables import Transaction
+from utils import config
+from utils.scheduler import market_time
+
+# rows are read and written in batches of this many, which bounds memory per table
+BATCH_SIZE = 5000
+NULL = '\\N'
+ESCAPES = {'n': '\n', '\\': '\\'}
+
+def month(date):
+    return date.strftime('%Y-%m')
+
+def encode(value, kind):
+    if value is None:
+        return NULL
+    if isinstance(kind, DateTime):
+        return value.isoformat()
+    if isinstance(kind, (Integer, Float)):
+        return repr(value)
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n')
+
+def decode(text, kind):
+    if text == NULL:
+        return None
+    if isinstance(kind, DateTime):
+        return datetime.fromisoformat(text)
+    if isinstance(kind, Integer):
+        return int(text)
+    if isinstance(kind, Float):
+        return float(text)
+    return re.sub(r'\\(.)', lambda match: ESCAPES[match.group(1)], text)
+
+class Bounded(io.RawIOBase):
+    """Reads a file only up to `size` bytes, so a partial member left by a crashed append is never seen."""
+    def __init__(self, file, size):
+        self.file = file
+        self.left = size
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self.file.read(min(len(buffer), self.left))
+        self.left -= len(data)
+        buffer[:len(data)] = data
+        return len(data)
+
+class Archive:
+    """Month partitioned, append only column files of rows moved out of the database.
+    Every column of a table is stored as archive/<table>/<YYYY-MM>/<column>.gz, one value per line,
+    and every append adds a gzip member to each column file. manifest.json holds the committed row count
+    and byte size of each partition, so anything past them is left over from an interrupted append."""
+    def __init__(self, path='archive', retention_days=90):
+        self.path = path
+        self.retention_days = retention_days
+        self.lock = threading.Lock()
+
+    def _table_path(self, model, *parts):
+        return os.path.join(self.path, model.__tablename__, *parts)
+
+    def _manifest(self, model):
+        try:
+            with open(self._table_path(model, 'manifest.json')) as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {'partitions': {}, 'pending': None}
+
+    def _save_manifest(self, model, manifest):
+        path = self._table_path(model, 'manifest.json')
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as file:
+            json.dump(manifest, file, indent=1, sort_keys=True)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(path + '.tmp', path)
+
+    def _append(self, model, partitions, key, columns):
+        """Append one batch of column values to a partition."""
+        partition = partitions.setdefault(key, {'rows': 0, 'sizes': {}})
+        os.makedirs(self._table_path(model, key), exist_ok=True)
+        for column, values in columns.items():
+            path = self._table_path(model, key, column + '.gz')
+            size = partition['sizes'].get(column, 0)
+            with open(path, 'ab') as file:
+                # drop whatever an interrupted append left behind
+                file.truncate(size)
+                file.write(gzip.compress(''.join(value + '\n' for value in values).encode()))
+                file.flush()
+                os.fsync(file.fileno())
+                partition['sizes'][column] = file.tell()
+        partition['rows'] += len(next(iter(columns.values())))
+
+    def move(self, db, model, cutoff):
+        """Archive and delete the rows of a table dated before the cutoff. Commits the session. Returns the moved row count."""
+        table = model.__table__
+        with self.lock:
+            manifest = self._manifest(model)
+            pending = manifest['pending']
+            if pending:
+                # the last move was archived but may not have been deleted
+                db.query(model).filter(model.id <= pending['last_id']).filter(model.date < datetime.fromisoformat(pending['cutoff'])).delete(synchronize_session=False)
+            rows = db.query(*table.columns).filter(model.date < cutoff).order_by(model.id).yield_per(BATCH_SIZE)
+            buffers = {}
+            moved, last_id = 0, None
+            for row in rows:
+                key = month(row.date)
+                buffer = buffers.setdefault(key, {column.name: [] for column in table.columns})
+                for column in table.columns:
+                    buffer[column.name].append(encode(getattr(row, column.name), column.type))
+                if len(buffer['id']) >= BATCH_SIZE:
+                    self._append(model, manifest['partitions'], key, buffers.pop(key))
+                moved += 1
+                last_id = row.id
+            for key, buffer in buffers.items():
+                self._append(model, manifest['partitions'], key, buffer)
+            if moved:
+                manifest['pending'] = {'last_id': last_id, 'cutoff': cutoff.isoformat()}
+                self._save_manifest(model, manifest)
+                db.query(model).filter(model.id <= last_id).filter(model.date < cutoff).delete(synchronize_session=False)
+            db.commit()
+            if moved or pending:
+                manifest['pending'] = None
+                self._save_manifest(model, manifest)
+            return moved
+
+    def _column(self, model, key, name, rows, size):
+        kind = model.__table__.columns[name].type
+        with open(self._table_path(model, key, name + '.gz'), 'rb') as raw:
+            file = io.TextIOWrapper(gzip.GzipFile(fileobj=io.BufferedReader(Bounded(raw, size))), encoding='utf-8', newline='\n')
+            for _, line in zip(range(rows), file):
+                yield decode(line[:-1], kind)
+
+    def scan(self, model, columns, since=None, until=None):
+        """Yields archived rows of the given columns as tuples, oldest month first, reading only those column files."""
+        manifest = self._manifest(model)
+        first = month(since) if since is not None else None
+        last = month(until) if until is not None else None
+        for key, partition in sorted(manifest['partitions'].items()):
+            if (first is not None and key < first) or (last is not None and key > last):
+                continue
+            yield from zip(*[self._column(model, key, name, partition['rows'], partition['sizes'][name]) for name in columns])
+
+    def history(self, db, model, columns, since=None, until=None):
+        """Yields rows of the given columns dated within [since, until], from the archive and then the live table.
+        `columns` must start with 'date'."""
+        for row in self.scan(model, columns, since, until):
+            if (since is None or row[0] >= since) and (until is None or row[0] <= until):
+                yield row
+        query = db.query(*[getattr(model, name) for name in columns])
+        if since is not None:
+            query = query.filter(model.date >= since)
+        if until is not None:
+            query = query.filter(model.date <= until)
+        yield from query.order_by(model.date).yield_per(BATCH_SIZE)
+
+    def archive(self):
+        """Move transactions older than the retention window into the archive.
+        Close and net worth history are moved by the rollup compaction instead."""
+        start = time_t.monotonic()
+        # dates are stored as naive market times
+        cutoff = datetime.combine((market_time() - timedelta(days=self.retention_days)).date(), time())
+        with DB() as db:
+            moved = self.move(db, Transaction, cutoff)
+        print(f"archive: {moved} transactions archived in {time_t.monotonic() - start:.2f}s")
+
+_archive = None
+_archive_lock = threading.Lock()
+
+def get_archive():
+    """Returns the archive shared by the archive job, rollup compaction and $export."""
+    global _archive
+    with _archive_lock:
+        if _archive is None:
+            conf = config.load('archive', required=False)
+            _archive = Archive(path=conf.get('path', fallback='archive'), retention_days=conf.getint('retention_days', fallback=90))
+        return _archive
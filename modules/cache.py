@@ -0,0 +1,178 @@
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event
+from utils import config
+from utils.scheduler import market_open_status
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+class QuoteCache:
+    """Thread safe LRU cache of quotes with a TTL and single-flight fetching."""
+    def __init__(self, ttl_open=15, ttl_closed=600, max_size=2048):
+        self.ttl_open = ttl_open
+        self.ttl_closed = ttl_closed
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.inflight = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def ttl(self):
+        return self.ttl_open if market_open_status() else self.ttl_closed
+
+    def _lookup(self, symbol):
+        # must hold lock
+        entry = self.entries.get(symbol)
+        if entry and time.monotonic() - entry[0] < self.ttl():
+            self.entries.move_to_end(symbol)
+            return entry[1]
+        return None
+
+    def _store(self, symbol, quote):
+        # must hold lock
+        self.entries[symbol] = (time.monotonic(), quote)
+        self.entries.move_to_end(symbol)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get(self, symbol, fetch):
+        """Return a cached quote for symbol, calling fetch(symbol) on a miss.
+        Concurrent misses for the same symbol share a single fetch."""
+        with self.lock:
+            quote = self._lookup(symbol)
+            if quote is not None:
+                self.hits += 1
+                return quote
+            self.misses += 1
+            flight = self.inflight.get(symbol)
+            leader = flight is None
+            if leader:
+                flight = self.inflight[symbol] = _Flight()
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return flight.value
+        try:
+            flight.value = fetch(symbol)
+            with self.lock:
+                self._store(symbol, flight.value)
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.inflight[symbol]
+            flight.done.set()
+
+    def put_many(self, quotes):
+        """Warm the cache with freshly fetched quotes."""
+        with self.lock:
+            for symbol, quote in quotes.items():
+                if quote:
+                    self._store(symbol, quote)
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+class ViewCache:
+    """Thread safe LRU cache of rendered per-company views such as $inv, keyed by (company id, view).
+    Every invalidation bumps a version, and a view computed from a read that started before
+    its company was last invalidated is not stored, so a slow read never caches stale data."""
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        # uid -> active company id, learnt from computed views
+        self.owners = {}
+        self.counter = 0
+        # company id -> version of its last invalidation
+        self.invalidated = {}
+        self.cleared = 0
+        self.views = set()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def version(self):
+        """Read before querying the data a view is computed from, and pass to put()."""
+        with self.lock:
+            return self.counter
+
+    def company(self, uid):
+        return self.owners.get(uid)
+
+    def get(self, company_id, view):
+        with self.lock:
+            value = self.entries.get((company_id, view))
+            if value is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end((company_id, view))
+            self.hits += 1
+            return value
+
+    def put(self, uid, company_id, view, value, version):
+        with self.lock:
+            self.owners[uid] = company_id
+            if max(self.cleared, self.invalidated.get(company_id, 0)) > version:
+                return
+            self.views.add(view)
+            self.entries[(company_id, view)] = value
+            self.entries.move_to_end((company_id, view))
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, company_id):
+        with self.lock:
+            self.counter += 1
+            self.invalidated[company_id] = self.counter
+            for view in self.views:
+                self.entries.pop((company_id, view), None)
+
+    def invalidate_on_commit(self, db, company_id):
+        """Invalidate a company once the session changing it commits."""
+        event.listen(db, 'after_commit', lambda session: self.invalidate(company_id), once=True)
+
+    def clear(self):
+        with self.lock:
+            self.counter += 1
+            self.cleared = self.counter
+            self.entries.clear()
+
+    def stats(self):
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'size': len(self.entries)}
+
+_quote_cache = None
+_quote_cache_lock = threading.Lock()
+
+def get_quote_cache():
+    """Returns the quote cache shared by every Iex instance in this process."""
+    global _quote_cache
+    with _quote_cache_lock:
+        if _quote_cache is None:
+            conf = config.load('cache', required=False)
+            _quote_cache = QuoteCache(
+                ttl_open=conf.getfloat('ttl_open', fallback=15),
+                ttl_closed=conf.getfloat('ttl_closed', fallback=600),
+                max_size=conf.getint('max_size', fallback=2048))
+        return _quote_cache
+
+_view_cache = None
+_view_cache_lock = threading.Lock()
+
+def get_view_cache():
+    """Returns the view cache shared by the cog, which fills it, and Iex, which invalidates it."""
+    global _view_cache
+    with _view_cache_lock:
+        if _view_cache is None:
+            _view_cache = ViewCache(max_size=config.load('cache', required=False).getint('view_size', fallback=1024))
+        return _view_cache
@@ -0,0 +1,194 @@
+import json
+import os
+import random
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from utils import config, metrics
+from utils.scheduler import market_time
+
+# request priorities. low priority requests are deferred once the credit budget runs low
+HIGH = 'high'
+LOW = 'low'
+# message credits per symbol of each endpoint, or per call for reference data
+CREDITS = {'quote': 1, 'splits': 10, 'dividends': 10, 'symbols': 100}
+# concurrent requests allowed per endpoint, so a batch job cannot starve player quotes
+CONCURRENCY = {'quote': 8, 'splits': 2, 'dividends': 2, 'symbols': 1}
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+class ExchangeError(Exception):
+    """The exchange could not be reached, or kept failing after retries."""
+
+class BudgetExceeded(ExchangeError):
+    """A low priority request was deferred to save message credits."""
+
+class TokenBucket:
+    """Allows `rate` requests per second on average, in bursts of up to `burst`."""
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+class CreditLedger:
+    """Running count of the message credits spent this month against a monthly budget.
+    Low priority requests are only allowed while more than `reserve` of the budget is left.
+    The count is saved to `path`, if given, so restarts do not reset it."""
+    def __init__(self, budget, reserve=0.2, path=None, save_interval=60):
+        self.budget = budget
+        self.reserve = reserve
+        self.path = path
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.month = market_time().strftime('%Y-%m')
+        self.spent = 0
+        self.deferred = 0
+        self.saved = 0
+        if path and os.path.exists(path):
+            with open(path) as file:
+                state = json.load(file)
+            if state.get('month') == self.month:
+                self.spent = state.get('spent', 0)
+
+    def _rollover(self):
+        month = market_time().strftime('%Y-%m')
+        if month != self.month:
+            self.month, self.spent = month, 0
+
+    def remaining(self):
+        with self.lock:
+            self._rollover()
+            return self.budget - self.spent
+
+    def allows(self, credits, priority=HIGH):
+        """Whether a request costing `credits` may be made now. Counts the deferral if not."""
+        with self.lock:
+            self._rollover()
+            left = self.budget - self.spent - credits
+            allowed = left >= 0 if priority == HIGH else left >= self.budget * self.reserve
+            if not allowed:
+                self.deferred += 1
+            return allowed
+
+    def charge(self, credits):
+        with self.lock:
+            self._rollover()
+            self.spent += credits
+            if self.path and time.monotonic() - self.saved >= self.save_interval:
+                self._save()
+
+    def _save(self):
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump({'month': self.month, 'spent': self.spent}, file)
+        os.replace(self.path + '.tmp', self.path)
+        self.saved = time.monotonic()
+
+    def stats(self):
+        with self.lock:
+            # None when no budget is set, which also keeps json dumps of the stats valid
+            budget = self.budget if self.budget != float('inf') else None
+            return {'spent': self.spent, 'budget': budget, 'deferred': self.deferred}
+
+class ExchangeClient:
+    """IEX cloud client over one pooled HTTP session.
+    Every request passes the credit ledger, a per-endpoint concurrency limit and a shared rate limit,
+    and timeouts, connection errors, 429s and 5xxs are retried with jittered exponential backoff."""
+    def __init__(self, token, base_url='https://cloud.iexapis.com/stable', pool_size=16, rate=50, burst=100,
+            retries=3, backoff=0.5, timeout=10, concurrency=None, ledger=None):
+        self.token = token
+        self.base_url = base_url.rstrip('/')
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = (3.05, timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.limits = {endpoint: threading.BoundedSemaphore(limit) for endpoint, limit in {**CONCURRENCY, **(concurrency or {})}.items()}
+        self.bucket = TokenBucket(rate, burst)
+        self.ledger = ledger or CreditLedger(budget=float('inf'))
+        self.retried = 0
+
+    def get(self, path, endpoint, credits, priority=HIGH, **params):
+        """GET a path of the API. Returns the decoded JSON body."""
+        if not self.ledger.allows(credits, priority):
+            raise BudgetExceeded(f"{endpoint} deferred, {self.ledger.remaining()} credits left this month")
+        with self.limits[endpoint]:
+            for attempt in range(self.retries + 1):
+                self.bucket.acquire()
+                retry_after = None
+                try:
+                    with metrics.registry.timer('iex_request_seconds', endpoint=endpoint):
+                        response = self.session.get(f'{self.base_url}/{path}', params={**params, 'token': self.token}, timeout=self.timeout)
+                except (requests.ConnectionError, requests.Timeout) as e:
+                    error = e
+                else:
+                    if response.ok:
+                        # iex reports the actual cost of each call
+                        self.ledger.charge(int(response.headers.get('iexcloud-messages-used', credits)))
+                        return response.json()
+                    if response.status_code not in RETRY_STATUSES:
+                        raise ExchangeError(f"{endpoint}: HTTP {response.status_code} {response.text[:200]}")
+                    error = f"HTTP {response.status_code}"
+                    retry_after = response.headers.get('Retry-After')
+                if attempt == self.retries:
+                    raise ExchangeError(f"{endpoint}: {error} after {attempt + 1} attempts")
+                self.retried += 1
+                # full jitter, so clients retrying together spread out
+                delay = random.uniform(0, self.backoff * 2 ** attempt)
+                time.sleep(float(retry_after) if retry_after and retry_after.isdigit() else delay)
+
+    def quote(self, symbol):
+        return self.get(f'stock/{symbol}/quote', 'quote', CREDITS['quote'])
+
+    def batch(self, symbols, endpoint, priority=HIGH, **params):
+        """Fetch one endpoint for up to 100 symbols in a single call. Returns a symbol -> result map."""
+        result = self.get('stock/market/batch', endpoint, CREDITS[endpoint] * len(symbols), priority,
+            symbols=','.join(symbols), types=endpoint, **params)
+        return {symbol: data.get(endpoint) for symbol, data in result.items()}
+
+    def symbols(self):
+        return self.get('ref-data/symbols', 'symbols', CREDITS['symbols'], LOW)
+
+    def stats(self):
+        return {**self.ledger.stats(), 'retried': self.retried}
+
+_exchange = None
+_exchange_lock = threading.Lock()
+
+def get_exchange():
+    """Returns the exchange client shared by every Iex instance in this process."""
+    global _exchange
+    with _exchange_lock:
+        if _exchange is None:
+            conf = config.load('exchange', required=False)
+            ledger = CreditLedger(
+                budget=conf.getfloat('monthly_budget', fallback=float('inf')),
+                reserve=conf.getfloat('reserve', fallback=0.2),
+                path=conf.get('ledger', fallback=None))
+            _exchange = ExchangeClient(
+                token=config.load('iex').get('token'),
+                base_url=conf.get('base_url', fallback='https://cloud.iexapis.com/stable'),
+                pool_size=conf.getint('pool_size', fallback=16),
+                rate=conf.getfloat('rate', fallback=50),
+                burst=conf.getint('burst', fallback=100),
+                retries=conf.getint('retries', fallback=3),
+                backoff=conf.getfloat('backoff', fallback=0.5),
+                timeout=conf.getfloat('timeout', fallback=10),
+                concurrency={endpoint: conf.getint(f'concurrency_{endpoint}') for endpoint in CONCURRENCY if conf.get(f'concurrency_{endpoint}')},
+                ledger=ledger)
+        return _exchange
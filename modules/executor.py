@@ -0,0 +1,49 @@
+import asyncio
+import contextvars
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import config
+
+class ExecutorBusy(Exception):
+    pass
+
+class Executor:
+    """Awaitable facade that runs blocking exchange and database work on a bounded thread pool."""
+    def __init__(self, workers=8, queue_depth=64):
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='stonks-worker')
+        self.workers = workers
+        self.capacity = workers + queue_depth
+        # only touched from the event loop, so no lock is needed
+        self.pending = 0
+
+    async def run(self, func, *args, **kwargs):
+        """Run func(*args, **kwargs) in the pool and await its result.
+        Raises ExecutorBusy instead of queueing once the queue is full."""
+        if self.pending >= self.capacity:
+            raise ExecutorBusy()
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            # carry context variables (such as the current command for metrics) into the worker
+            context = contextvars.copy_context()
+            return await loop.run_in_executor(self.pool, functools.partial(context.run, func, *args, **kwargs))
+        finally:
+            self.pending -= 1
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    """Returns the executor shared by all cogs in this process."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            conf = config.load('executor', required=False)
+            _executor = Executor(
+                workers=conf.getint('workers', fallback=8),
+                queue_depth=conf.getint('queue_depth', fallback=64))
+        return _executor
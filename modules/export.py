@@ -0,0 +1,57 @@
+import csv
+import io
+import tempfile
+from db.tables import Transaction, CompanyHistory
+from .archive import get_archive, BATCH_SIZE
+from .iex import TRANS_SELL, TRANS_BUY, TRANS_DIVIDEND
+
+# exports stay in memory up to this size and spill to disk beyond it
+SPOOL_SIZE = 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+# discord's upload limit
+MAX_BYTES = 8 * 1024 * 1024
+TRANSACTION_TYPES = {TRANS_SELL: 'sell', TRANS_BUY: 'buy', TRANS_DIVIDEND: 'dividend'}
+TRADE_HEADERS = ['Date', 'Symbol', 'Type', 'Quantity', 'Price']
+NETWORTH_HEADERS = ['Date', 'Net Worth']
+
+def _records(db, model, columns, company_id, since):
+    """Yields a company's rows of the given columns from the archive, then from the live table, oldest first."""
+    names = ['company', 'date'] + columns
+    for row in get_archive().scan(model, names, since):
+        if row[0] == company_id and (since is None or row[1] >= since):
+            yield row[1:]
+    query = db.query(*[getattr(model, name) for name in names[1:]]).filter(model.company == company_id)
+    if since is not None:
+        query = query.filter(model.date >= since)
+    yield from query.order_by(model.date).yield_per(BATCH_SIZE)
+
+def trades(db, company_id, since=None):
+    for date, symbol, trans_type, volume, price in _records(db, Transaction, ['symbol', 'trans_type', 'trans_volume', 'trans_price'], company_id, since):
+        yield [date.strftime('%Y-%m-%d %H:%M:%S'), symbol, TRANSACTION_TYPES.get(trans_type, trans_type), volume, price]
+
+def networth(db, company_id, since=None):
+    for date, value in _records(db, CompanyHistory, ['value'], company_id, since):
+        yield [date.strftime('%Y-%m-%d %H:%M:%S'), round(value, 2)]
+
+def write_csv(rows, headers, max_bytes=None):
+    """Writes rows to a spooled temporary file as CSV, a chunk at a time. Returns the file, rewound.
+    Raises ValueError once the file grows past max_bytes."""
+    spool = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+    chunk = io.StringIO()
+    writer = csv.writer(chunk)
+    writer.writerow(headers)
+    for row in rows:
+        writer.writerow(row)
+        if chunk.tell() >= CHUNK_SIZE:
+            _flush(spool, chunk, max_bytes)
+    _flush(spool, chunk, max_bytes)
+    spool.seek(0)
+    return spool
+
+def _flush(spool, chunk, max_bytes):
+    spool.write(chunk.getvalue().encode())
+    chunk.seek(0)
+    chunk.truncate()
+    if max_bytes is not None and spool.tell() > max_bytes:
+        spool.close()
+        raise ValueError(f"export is larger than {max_bytes} bytes")
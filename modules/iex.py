@@ -1,50 +1,137 @@
-from iexfinance import stocks
-from iexfinance.refdata import get_symbols
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, time, datetime
-from utils import config
+import time as time_t
+from sqlalchemy import func, and_
 from utils.scheduler import market_time
-from db.interface import DB, _list
-from db.tables import Symbol, CloseHistory, CompanyHistory, HeldStock, Company, Transaction
+from db.interface import DB, ReadDB, _list
+from db.tables import Symbol, CloseHistory, CompanyHistory, HeldStock, Company, Transaction, Leaderboard, Position
+from .cache import get_quote_cache, get_view_cache
+from .symbols import get_symbol_index
+from .stream import get_price_stream
+from .triggers import get_order_book
+from .orders import write_lock
+from .valuation import get_valuator
+from .exchange import get_exchange, BudgetExceeded, CREDITS, HIGH, LOW
+
+# iex caps batch requests at 100 symbols
+BATCH_SIZE = 100
+BATCH_WORKERS = 4
+
+# transaction types, see db/tables.py
+TRANS_SELL = 0
+TRANS_BUY = 1
+TRANS_DIVIDEND = 2
+# sign of the cash and holding changes each transaction type makes
+CASH_SIGN = {TRANS_SELL: 1, TRANS_BUY: -1, TRANS_DIVIDEND: 1}
+HOLDING_SIGN = {TRANS_SELL: -1, TRANS_BUY: 1, TRANS_DIVIDEND: 0}
+STARTING_BALANCE = 10000
+
+def cash_delta(trans_type, volume, price):
+    """Change in cash balance made by a recorded transaction."""
+    return CASH_SIGN[trans_type] * volume * price
+
+def holding_delta(trans_type, volume):
+    """Change in held quantity made by a recorded transaction."""
+    return HOLDING_SIGN[trans_type] * volume
+
+def chunks(items, size):
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def batch_stats(symbols):
+    """Returns the (symbol, request) counts of a batch fetch of these symbols."""
+    count = len(set(symbols))
+    return count, -(-count // BATCH_SIZE)
 
 class Iex:
     def __init__(self):
-        self.token = config.load('iex').get('token')
+        self.exchange = get_exchange()
+        self.cache = get_quote_cache()
+        self.stream = get_price_stream()
+        self.book = get_order_book()
+        self.valuator = get_valuator()
+        self.views = get_view_cache()
 
     def price(self, symbol):
+        if self.stream:
+            price = self.stream.price(symbol)
+            if price is not None:
+                return price
         quote = self.quote(symbol)
         return quote['latestPrice']
 
     def quote(self, symbol):
-        return stocks.Stock(symbol, token = self.token).get_quote()
+        return self.cache.get(symbol, self.fetch_quote)
+
+    def fetch_quote(self, symbol):
+        quote = self.exchange.quote(symbol)
+        self.book.on_prices({symbol: quote['latestPrice']})
+        return quote
     
+    def batch(self, symbols, endpoint, priority=HIGH, **kwargs):
+        """Fetch an endpoint for many symbols at once. Returns a symbol -> result map.
+        Low priority fetches raise BudgetExceeded up front if the whole fetch does not fit the credit budget."""
+        symbols = sorted(set(symbols))
+        if not symbols:
+            return {}
+        if priority == LOW and not self.exchange.ledger.allows(CREDITS[endpoint] * len(symbols), LOW):
+            raise BudgetExceeded(f"{endpoint} for {len(symbols)} symbols deferred, {self.exchange.ledger.remaining()} credits left this month")
+        def fetch(chunk):
+            return self.exchange.batch(chunk, endpoint, priority, **kwargs)
+        results = {}
+        batches = chunks(symbols, BATCH_SIZE)
+        with ThreadPoolExecutor(max_workers=min(BATCH_WORKERS, len(batches))) as pool:
+            for result in pool.map(fetch, batches):
+                results.update(result)
+        return results
+
+    def quotes(self, symbols):
+        return self.batch(symbols, 'quote')
+
+    def batch_splits(self, symbols):
+        return self.batch(symbols, 'splits', LOW, range='1m')
+
+    def batch_dividends(self, symbols):
+        return self.batch(symbols, 'dividends', LOW, range='1m')
+
     def get_symbols_in_use(self, db):
-        unique_symbols = db.query(HeldStock.symbol).distinct().all()
+        unique_symbols = db.query(Position.symbol).distinct().all()
         return _list(unique_symbols)
     
     def get_company(self, db, company_id):
         return db.query(Company).filter(Company.id == company_id).first()
     
     def get_owners_of(self, db, symbol):
-        owners = db.query(HeldStock.company).filter(HeldStock.symbol == symbol).distinct().all()
+        owners = db.query(Position.company).filter(Position.symbol == symbol).all()
         return _list(owners)
     
     def get_held_stocks(self, db, company):
         return db.query(HeldStock).filter(HeldStock.company == company).all()
     
+    def get_positions(self, db, company):
+        return db.query(Position).filter(Position.company == company).order_by(Position.symbol).all()
+
+    def get_position(self, db, company, symbol):
+        return db.query(Position).get((company, symbol))
+
     def get_held_stock_quantity(self, db, company, symbol):
-        quantity = db.query(HeldStock.quantity).filter(HeldStock.company == company).filter(HeldStock.symbol == symbol).all()
-        return sum(_list(quantity))
+        position = self.get_position(db, company, symbol)
+        return position.quantity if position else 0
     
-    def get_latest_close(self, db, symbol):
+    def latest_close(self, symbol):
+        """Returns the (close, volume) of a symbol from a quote, falling back to the previous close."""
         quote = self.quote(symbol)
-        close = quote['close']
-        volume = quote['volume']
         if not quote['close'] or not quote['volume']:
-            close = quote['previousClose']
-            volume = quote['previousVolume']
-        close_row = CloseHistory(symbol=symbol, date=market_time(), close=close, volume=volume)
-        db.add(close_row)
-        return close_row
+            return quote['previousClose'], quote['previousVolume']
+        return quote['close'], quote['volume']
+
+    def get_latest_close(self, symbol):
+        """Fetch and record the latest close of a symbol. Returns the recorded row, detached."""
+        close, volume = self.latest_close(symbol)
+        close_row = dict(symbol=symbol, date=market_time(), close=close, volume=volume)
+        # saved in a session of its own, since callers read through a read only one
+        with DB() as db:
+            db.bulk_insert_mappings(CloseHistory, [close_row])
+        return CloseHistory(**close_row)
 
     def splits(self):
         """Check for stock splits and process them."""
@@ -53,20 +140,30 @@ class Iex:
         # rebuying inventory at price * ratio and quantity / ratio
         # ratio = fromFactor / toFactor
         # company gets to keep liquidated cash in case of division with remainder
-        with DB() as db:
+        with ReadDB() as db:
             unique_symbols = self.get_symbols_in_use(db)
-            pending_splits = {}
-            now = market_time()
-            # first, find which stocks start trading at split price today
-            for symbol in unique_symbols:
-                stock = stocks.Stock(symbol, token = self.token)
-                splits = stock.get_splits(range='1m')
-                for split in splits:
-                    if now.date()  == date.fromisoformat(split['exDate']):
-                        pending_splits[symbol] = {
-                            'from': split['fromFactor'],
-                            'to': split['toFactor']}
-            
+        pending_splits = {}
+        now = market_time()
+        # first, find which stocks start trading at split price today
+        # the exchange is only asked outside the write lock, so trades are not held up by slow requests
+        try:
+            all_splits = self.batch_splits(unique_symbols)
+        except BudgetExceeded as e:
+            print(f"splits: {e}")
+            return
+        count, requests = batch_stats(unique_symbols)
+        print(f"splits: fetched {count} symbols in {requests} requests")
+        for symbol, splits in all_splits.items():
+            for split in splits or []:
+                if now.date()  == date.fromisoformat(split['exDate']):
+                    pending_splits[symbol] = {
+                        'from': split['fromFactor'],
+                        'to': split['toFactor']}
+        if not pending_splits:
+            return
+        closes = {symbol: self.latest_close(symbol) for symbol in pending_splits}
+
+        with write_lock, DB() as db:
             # process affected companies
             for symbol in pending_splits:
                 affected_companies = self.get_owners_of(db, symbol)
@@ -74,7 +171,8 @@ class Iex:
                 fromFactor = pending_splits[symbol]['from']
                 toFactor = pending_splits[symbol]['to']
 
-                sell_price = self.get_latest_close(db, symbol).close
+                sell_price, volume = closes[symbol]
+                db.add(CloseHistory(symbol=symbol, date=market_time(), close=sell_price, volume=volume))
                 rebuy_price = sell_price * fromFactor / toFactor
 
                 for company_id in affected_companies:
@@ -93,19 +191,27 @@ class Iex:
         # for all intents and purposes, we can take exDate to be the cutoff point for eligibility
         # paymentDate - the date when dividend payments are processed
         # amount - the amount paid per share
-        with DB() as db:
+        with ReadDB() as db:
             unique_symbols = self.get_symbols_in_use(db)
-            pending_dividends = {}
-            # first, find which stocks must get dividend payments today
-            for symbol in unique_symbols:
-                stock = stocks.Stock(symbol, token = self.token)
-                dividends = stock.get_dividends(range='1m')
-                for event in dividends:
-                    if market_time().date()  == date.fromisoformat(event['paymentDate']):
-                        pending_dividends[symbol] = {
-                            'amount': event['amount'],
-                            'cutoff': datetime.combine(date.fromisoformat(event['exDate']), time())}
-            
+        pending_dividends = {}
+        # first, find which stocks must get dividend payments today, outside the write lock
+        try:
+            all_dividends = self.batch_dividends(unique_symbols)
+        except BudgetExceeded as e:
+            print(f"dividends: {e}")
+            return
+        count, requests = batch_stats(unique_symbols)
+        print(f"dividends: fetched {count} symbols in {requests} requests")
+        for symbol, dividends in all_dividends.items():
+            for event in dividends or []:
+                if market_time().date()  == date.fromisoformat(event['paymentDate']):
+                    pending_dividends[symbol] = {
+                        'amount': event['amount'],
+                        'cutoff': datetime.combine(date.fromisoformat(event['exDate']), time())}
+        if not pending_dividends:
+            return
+
+        with write_lock, DB() as db:
             # process affected companies
             for symbol in pending_dividends:
                 affected_companies = self.get_owners_of(db, symbol)
@@ -117,73 +223,145 @@ class Iex:
                     eligible_quantity = sum(_list(eligible_quantity))
 
                     dividend_amount = pending_dividends[symbol]['amount']
-                    value = dividend_amount * eligible_quantity
-                    company.balance += value
+                    company.balance += cash_delta(TRANS_DIVIDEND, eligible_quantity, dividend_amount)
+                    self.valuator.mark_dirty(company_id)
+                    self.views.invalidate_on_commit(db, company_id)
                     # Record dividend income.
-                    db.add(Transaction(symbol=symbol, company=company_id, trans_type=2, trans_volume=eligible_quantity, trans_price=dividend_amount, date=market_time()))
+                    db.add(Transaction(symbol=symbol, company=company_id, trans_type=TRANS_DIVIDEND, trans_volume=eligible_quantity, trans_price=dividend_amount, date=market_time()))
 
     def buy(self, db, company_id, symbol, quantity, price):
         """Buy stock, at given price and quantity, without error checking."""
         value = price * quantity
         # add stock
         db.add(HeldStock(symbol=symbol, quantity=quantity, company=company_id, purchase_price=price, purchase_date=market_time()))
+        position = self.get_position(db, company_id, symbol)
+        if position:
+            position.quantity += quantity
+            position.cost_basis += value
+            position.lots += 1
+        else:
+            db.add(Position(company=company_id, symbol=symbol, quantity=quantity, cost_basis=value, lots=1))
         # subtract balance
         company = self.get_company(db, company_id)
-        company.balance -= value
+        company.balance += cash_delta(TRANS_BUY, quantity, price)
+        self.valuator.mark_dirty(company_id)
+        self.views.invalidate_on_commit(db, company_id)
         # record transaction
-        db.add(Transaction(symbol=symbol, company=company_id, trans_type=1, trans_volume=quantity, trans_price=price, date=market_time()))
+        db.add(Transaction(symbol=symbol, company=company_id, trans_type=TRANS_BUY, trans_volume=quantity, trans_price=price, date=market_time()))
+
+    def consume_lots(self, db, company_id, symbol, quantity):
+        """Remove quantity from the oldest lots first. Returns (consumed quantity, consumed cost, emptied lot count)."""
+        # running total of the lots before each one, so only the lots needed are read
+        order = (HeldStock.purchase_date.asc(), HeldStock.id.asc())
+        held_before = (func.sum(HeldStock.quantity).over(order_by=order) - HeldStock.quantity).label('held_before')
+        ordered = db.query(HeldStock.id, held_before).filter(HeldStock.company==company_id).filter(HeldStock.symbol==symbol).subquery()
+        lots = db.query(HeldStock).join(ordered, HeldStock.id == ordered.c.id).filter(ordered.c.held_before < quantity).order_by(*order).all()
+        consumed, cost, emptied = 0, 0.0, []
+        for lot in lots:
+            amnt = min(quantity - consumed, lot.quantity)
+            consumed += amnt
+            cost += amnt * lot.purchase_price
+            if amnt == lot.quantity:
+                # emptied lots are left untouched in the session and deleted in bulk below
+                emptied.append(lot.id)
+            else:
+                lot.quantity -= amnt
+        if emptied:
+            db.query(HeldStock).filter(HeldStock.id.in_(emptied)).delete(synchronize_session=False)
+        return consumed, cost, len(emptied)
 
     def sell(self, db, company_id, symbol, quantity, price):
         """Sell stock, at given price and quantity, without error checking."""
-        value = price * quantity
-        stocks = db.query(HeldStock).filter(HeldStock.company==company_id).filter(HeldStock.symbol==symbol).order_by(HeldStock.purchase_date.asc())
         # FIFO subtract stock
-        for s in stocks:
-            amnt = min(quantity, s.quantity)
-            s.quantity -= amnt
-            quantity -= amnt
-            if quantity == 0:
-                break
-        # delete 0 quant rows
-        for s in stocks:
-            if s.quantity == 0:
-                db.delete(s)
+        sold, cost, emptied = self.consume_lots(db, company_id, symbol, quantity)
+        position = self.get_position(db, company_id, symbol)
+        position.quantity -= sold
+        position.cost_basis -= cost
+        position.lots -= emptied
+        if position.quantity == 0:
+            db.delete(position)
+            # flush so a following buy in the same session (splits) starts a fresh position
+            db.flush()
         # add balance
         company = self.get_company(db, company_id)
-        company.balance += value
+        company.balance += cash_delta(TRANS_SELL, sold, price)
+        self.valuator.mark_dirty(company_id)
+        self.views.invalidate_on_commit(db, company_id)
         # Record sell transaction
-        db.add(Transaction(symbol=symbol, company=company_id, trans_type=0, trans_volume=quantity, trans_price=price, date=market_time()))
+        db.add(Transaction(symbol=symbol, company=company_id, trans_type=TRANS_SELL, trans_volume=sold, trans_price=price, date=market_time()))
     
     def update_symbols(self):
-        """Update internal list of symbols."""
-        symbols = get_symbols(token = self.token)
-        # handle adding of symbols
+        """Sync the internal list of symbols with the exchange in one diff-and-upsert pass.
+        Delisted symbols are marked inactive rather than deleted, since companies may still hold them."""
+        start = time_t.monotonic()
+        listed = {}
+        symbols = self.exchange.symbols()
+        for symbol in symbols:
+            listed[symbol['symbol']] = dict(symbol=symbol['symbol'], name=symbol['name'], stock_type=symbol['type'], active=symbol.get('isEnabled', True))
         with DB() as db:
-            for symbol in symbols:
-                sym = symbol['symbol']
-                if not db.query(Symbol).filter(Symbol.symbol==sym).first():
-                    db.add(Symbol(symbol=sym, name=symbol['name'], stock_type=symbol['type']))
-        # handle removal of symbols?
-        # I think this is a bit more complicated, because what happens if someone owns stock etc
-        # leave for later
-    
-    def evaluate(self):
-        """Evaluate the net worth all player companies. Accumulate statistical information."""
-        with DB() as db:
-            # get the close value of all stock in use
-            symbols = self.get_symbols_in_use(db)
-            now = market_time()
-            for symbol in symbols:
-                quote = self.quote(symbol)
-                price = quote['latestPrice']
-                volume = quote['latestVolume']
-                db.add(CloseHistory(symbol=symbol, date=now, close=price, volume=volume))
-            companies = db.query(Company).filter(Company.active == True).all()
+            existing = {row.symbol: row for row in db.query(Symbol.symbol, Symbol.name, Symbol.stock_type, Symbol.active)}
+            added = [listed[sym] for sym in listed.keys() - existing.keys()]
+            changed = [listed[sym] for sym in listed.keys() & existing.keys()
+                if (existing[sym].name, existing[sym].stock_type, existing[sym].active) != (listed[sym]['name'], listed[sym]['stock_type'], listed[sym]['active'])]
+            delisted = [dict(symbol=sym, active=False) for sym, row in existing.items() if sym not in listed and row.active]
+            db.bulk_insert_mappings(Symbol, added)
+            db.bulk_update_mappings(Symbol, changed + delisted)
+        get_symbol_index().refresh()
+        print(f"update_symbols: {len(added)} added, {len(changed)} changed, {len(delisted)} delisted in {time_t.monotonic() - start:.2f}s")
+        return added, changed, delisted
+
+    def get_last_closes(self, db, symbols):
+        """Returns the most recent recorded close for each symbol, in one query."""
+        latest = db.query(CloseHistory.symbol, func.max(CloseHistory.date).label('date')).filter(CloseHistory.symbol.in_(symbols)).group_by(CloseHistory.symbol).subquery()
+        closes = db.query(CloseHistory.symbol, CloseHistory.close).join(latest, and_(CloseHistory.symbol == latest.c.symbol, CloseHistory.date == latest.c.date)).all()
+        return dict(closes)
+
+    def update_leaderboard(self, db, net_worths, now):
+        """Replace the leaderboard with freshly evaluated net worths, keeping the previous ranks."""
+        previous = dict(db.query(Leaderboard.company, Leaderboard.rank).all())
+        ranked = sorted(net_worths.items(), key=lambda item: item[1], reverse=True)
+        db.query(Leaderboard).delete(synchronize_session=False)
+        db.bulk_insert_mappings(Leaderboard, [
+            dict(company=company_id, value=value, rank=rank, previous_rank=previous.get(company_id), date=now)
+            for rank, (company_id, value) in enumerate(ranked, 1)])
+
+    def evaluate(self, full=False):
+        """Evaluate the net worth all player companies. Accumulate statistical information.
+        Only companies that traded or hold a symbol whose price moved are revalued, unless full is set."""
+        with ReadDB() as db:
+            held = self.get_symbols_in_use(db)
+        # symbols with standing orders are priced as well, so their triggers are checked
+        symbols = sorted(set(held) | self.book.triggers.symbols())
+        now = market_time()
+        # get the close value of all stock in use
+        # streamed prices are used as is, only the rest is fetched
+        streamed = self.stream.snapshot(symbols) if self.stream else {}
+        fetched = [symbol for symbol in symbols if symbol not in streamed]
+        quotes = self.quotes(fetched)
+        count, requests = batch_stats(fetched)
+        print(f"evaluate: fetched {count} symbols in {requests} requests, {len(streamed)} streamed")
+        self.cache.put_many(quotes)
+        quotes.update(streamed)
+        prices = {}
+        close_rows = []
+        for symbol, quote in quotes.items():
+            prices[symbol] = quote['latestPrice']
+            close_rows.append(dict(symbol=symbol, date=now, close=quote['latestPrice'], volume=quote['latestVolume']))
+        # trades commit under the write lock, so no company is marked dirty while it is being reloaded
+        with write_lock, DB() as db:
+            db.bulk_insert_mappings(CloseHistory, close_rows)
+            missing = set(self.get_symbols_in_use(db)) - set(prices)
+            # fall back to the last known close for symbols the exchange did not return
+            valuation_prices = {**self.get_last_closes(db, missing), **prices} if missing else prices
             # evaluate the net worth of every company
-            for company in companies:
-                inventory = self.get_held_stocks(db, company.id)
-                value = company.balance
-                for stock in inventory:
-                    ch = db.query(CloseHistory).filter(CloseHistory.symbol == stock.symbol).filter(CloseHistory.date == now).first()
-                    value += ch.close * stock.quantity
-                db.add(CompanyHistory(company=company.id, date=now, value=value))
+            net_worths = self.valuator.evaluate(db, valuation_prices, full=full)
+            db.bulk_insert_mappings(CompanyHistory, [dict(company=company_id, date=now, value=value) for company_id, value in net_worths.items()])
+            self.update_leaderboard(db, net_worths, now)
+        # every view shows the new closes and net worths
+        self.views.clear()
+        self.book.on_prices(prices)
+
+    def check_valuation(self, tolerance=0.01):
+        """Compare the incremental net worths against a full recompute. Returns {company: (incremental, full)} for mismatches."""
+        with ReadDB() as db:
+            return self.valuator.check(db, tolerance)
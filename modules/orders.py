@@ -0,0 +1,80 @@
+import asyncio
+import threading
+from collections import namedtuple
+from db.interface import DB, ReadDB
+from utils import config
+
+BUY = 'buy'
+SELL = 'sell'
+
+Order = namedtuple('Order', ['side', 'uid', 'quantity', 'symbol'])
+
+# every fill in this process happens under this lock, so checks on a company's balance and inventory never race
+write_lock = threading.Lock()
+
+class OrderEngine:
+    """Queues market orders, groups them per symbol over a short window,
+    fills each group at one fetched price and commits it in a single transaction."""
+    def __init__(self, executor, price, fill, window=0.25, check=None):
+        """price : price(symbol), blocking
+        fill : fill(db, order, price), blocking, returns the acknowledgement or raises to reject the order
+        check : check(db, order), blocking, raises to reject the order before a price is fetched for it"""
+        self.executor = executor
+        self.price = price
+        self.fill = fill
+        self.check = check
+        self.window = window
+        # symbol -> [(order, future)], only touched from the event loop
+        self.queues = {}
+
+    async def submit(self, order):
+        """Queue an order and wait for its acknowledgement."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.queues.get(order.symbol)
+        if batch is None:
+            batch = self.queues[order.symbol] = []
+            loop.call_later(self.window, lambda: asyncio.ensure_future(self._flush(order.symbol)))
+        batch.append((order, future))
+        return await future
+
+    async def _flush(self, symbol):
+        batch = self.queues.pop(symbol)
+        try:
+            results = await self.executor.run(self.execute, symbol, [order for order, _ in batch])
+        except Exception as e:
+            results = [e] * len(batch)
+        for (_, future), result in zip(batch, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+    def execute(self, symbol, orders):
+        """Fill a batch of orders for one symbol at a single price. Rejections are returned, not raised."""
+        results = [None] * len(orders)
+        if self.check:
+            # reject what can be rejected without a quote, so those orders cost no exchange request
+            with ReadDB() as db:
+                for i, order in enumerate(orders):
+                    try:
+                        self.check(db, order)
+                    except Exception as e:
+                        results[i] = e
+        pending = [i for i, result in enumerate(results) if result is None]
+        if not pending:
+            return results
+        price = self.price(symbol)
+        with write_lock, DB() as db:
+            # orders are checked and filled one after another, in arrival order
+            for i in pending:
+                try:
+                    results[i] = self.fill(db, orders[i], price)
+                except Exception as e:
+                    results[i] = e
+        return results
+
+def order_window():
+    return config.load('orders', required=False).getfloat('window', fallback=0.25)
@@ -0,0 +1,34 @@
+from tabulate import tabulate
+
+INV_HEADERS = ['Symbol', 'Quantity', 'Value']
+DAILY_HEADERS = ['Δ', '%', 'Symbol', 'Quantity', 'Purchase Price', 'Close', 'Current Value']
+SCORE_HEADERS = ['#', 'Company', 'Net Worth', '']
+
+def percent_change(purchase_price, close):
+    """Unsigned change from purchase price to close, in percent to one decimal."""
+    if not purchase_price:
+        return float('inf') if close != purchase_price else float('nan')
+    return round(abs((close - purchase_price) / purchase_price * 100), 1)
+
+def daily_rows(lots):
+    """Turns (symbol, quantity, purchase price, close) lots into daily rows, sorted by symbol."""
+    rows = []
+    for symbol, quantity, purchase_price, close in lots:
+        value = quantity * close - quantity * purchase_price
+        rows.append(['+' if value >= 0 else '-', percent_change(purchase_price, close), symbol, quantity, purchase_price, close, value])
+    # stable, so lots of one symbol keep their purchase order. the pandas version this replaced
+    # sorted with quicksort, which left them in an arbitrary order
+    rows.sort(key=lambda row: row[2])
+    return rows
+
+def inv_table(positions):
+    """Renders (symbol, quantity, value) rows."""
+    return f'```{tabulate(positions, headers=INV_HEADERS, showindex=True)}```'
+
+def daily_table(lots):
+    """Renders (symbol, quantity, purchase price, close) lots as a diff block of gains and losses."""
+    return f'```diff\n{tabulate(daily_rows(lots), headers=DAILY_HEADERS)}```'
+
+def score_table(scores, page, pages):
+    """Renders (position, company, net worth, rank change) rows with a page footer."""
+    return f"```{tabulate(scores, headers=SCORE_HEADERS)}\n\nPage {page}/{pages}```"
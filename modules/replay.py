@@ -0,0 +1,181 @@
+import argparse
+import csv
+import time as time_t
+from datetime import datetime, timedelta
+import numpy as np
+from db import interface
+from db.interface import ReadDB
+from db.tables import CloseHistory, CompanyHistory, Transaction
+from .archive import get_archive
+from .iex import cash_delta, holding_delta, STARTING_BALANCE, TRANS_DIVIDEND
+
+# closes this long before the start are read, so held symbols have a price at the first evaluation
+LOOKBACK = timedelta(days=7)
+# holdings rows built at a time, which bounds the working memory of a replay to this many rows x evaluations
+PAIR_CHUNK = 1024
+
+def naive(date):
+    return date.replace(tzinfo=None)
+
+class Index:
+    """Dense indexes of keys, in order of first appearance."""
+    def __init__(self):
+        self.keys = {}
+
+    def __call__(self, key):
+        return self.keys.setdefault(key, len(self.keys))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def inverse(self):
+        return list(self.keys)
+
+class Replay:
+    """Rebuilds the net worth curve of every company from recorded closes and the transaction log.
+    Net worths are computed at the stored evaluation times from a symbols x times price matrix and
+    (company, symbol) x times holdings, built a chunk of pairs at a time, with the cash and holding semantics of Iex."""
+    def __init__(self, start, end, starting_balance=STARTING_BALANCE, dividends=True):
+        self.start = start
+        self.end = end
+        self.starting_balance = starting_balance
+        self.dividends = dividends
+        self.companies = Index()
+        self.symbols = Index()
+
+    def load(self, db):
+        archive = get_archive()
+        # the stored evaluations give the times to replay at, and the values to diff against
+        stored = [(naive(date), self.companies(company), value) for date, company, value
+            in archive.history(db, CompanyHistory, ['date', 'company', 'value'], self.start, self.end)]
+        self.times = np.array(sorted({date for date, _, _ in stored}), dtype='datetime64[us]')
+        self.stored_at = self._at([date for date, _, _ in stored])
+        self.stored_company = np.array([company for _, company, _ in stored], dtype=np.intp)
+        self.stored_value = np.array([value for _, _, value in stored], dtype=float)
+
+        closes = [(naive(date), self.symbols(symbol), close) for date, symbol, close
+            in archive.history(db, CloseHistory, ['date', 'symbol', 'close'], self.start - LOOKBACK, self.end) if close is not None]
+        self.close_at = self._at([date for date, _, _ in closes])
+        self.close_symbol = np.array([symbol for _, symbol, _ in closes], dtype=np.intp)
+        self.close_value = np.array([close for _, _, close in closes], dtype=float)
+
+        # holdings at the start depend on every earlier trade, so the log is read from the beginning
+        trades = []
+        for date, company, symbol, trans_type, volume, price in archive.history(db, Transaction,
+                ['date', 'company', 'symbol', 'trans_type', 'trans_volume', 'trans_price'], None, self.end):
+            if trans_type == TRANS_DIVIDEND and not self.dividends:
+                continue
+            trades.append((naive(date), self.companies(company), self.symbols(symbol), cash_delta(trans_type, volume, price), holding_delta(trans_type, volume)))
+        self.trade_at = self._at([trade[0] for trade in trades])
+        self.trade_company = np.array([trade[1] for trade in trades], dtype=np.intp)
+        self.trade_symbol = np.array([trade[2] for trade in trades], dtype=np.intp)
+        self.trade_cash = np.array([trade[3] for trade in trades], dtype=float)
+        self.trade_quantity = np.array([trade[4] for trade in trades], dtype=float)
+
+    def _at(self, dates):
+        """Index of the first evaluation at or after each date. Anything before the start counts towards the first one."""
+        return np.searchsorted(self.times, np.array(dates, dtype='datetime64[us]'), side='left').astype(np.intp)
+
+    def prices(self):
+        """Symbols x times matrix of the last close at or before each evaluation, 0 where there is none."""
+        symbols, times = len(self.symbols), len(self.times)
+        keep = self.close_at < times
+        flat = self.close_symbol[keep] * times + self.close_at[keep]
+        values = self.close_value[keep]
+        # closes are in date order, so the last one of each cell wins
+        _, last = np.unique(flat[::-1], return_index=True)
+        last = len(flat) - 1 - last
+        prices = np.full(symbols * times, np.nan)
+        prices[flat[last]] = values[last]
+        prices = prices.reshape(symbols, times)
+        # carry each close forward to the evaluations that have none
+        filled = np.where(np.isnan(prices), 0, np.arange(times))
+        np.maximum.accumulate(filled, axis=1, out=filled)
+        prices = prices[np.arange(symbols)[:, None], filled]
+        self.unpriced = int(np.isnan(prices[:, -1]).sum()) if times else 0
+        return np.nan_to_num(prices)
+
+    def run(self):
+        """Returns the companies x times matrix of replayed net worths."""
+        companies, times = len(self.companies), len(self.times)
+        keep = self.trade_at < times
+        at, company, symbol = self.trade_at[keep], self.trade_company[keep], self.trade_symbol[keep]
+        cash = np.zeros((companies, times))
+        np.add.at(cash, (company, at), self.trade_cash[keep])
+        worth = self.starting_balance + np.cumsum(cash, axis=1)
+        # one holdings row per (company, symbol) pair that ever traded, with the trades grouped by pair
+        width = max(len(self.symbols), 1)
+        pairs, pair = np.unique(company * width + symbol, return_inverse=True)
+        order = np.argsort(pair, kind='stable')
+        pair, at, quantity = pair[order], at[order], self.trade_quantity[keep][order]
+        pair_company, pair_symbol = np.divmod(pairs, width)
+        prices = self.prices()
+        # the pairs are valued a chunk at a time, so no pairs x times matrix is ever held whole
+        for first in range(0, len(pairs), PAIR_CHUNK):
+            last = min(first + PAIR_CHUNK, len(pairs))
+            lo, hi = np.searchsorted(pair, [first, last])
+            holdings = np.zeros((last - first, times))
+            np.add.at(holdings, (pair[lo:hi] - first, at[lo:hi]), quantity[lo:hi])
+            np.cumsum(holdings, axis=1, out=holdings)
+            holdings *= prices[pair_symbol[first:last]]
+            np.add.at(worth, pair_company[first:last], holdings)
+        self.worth = worth
+        return worth
+
+    def diff(self, tolerance=0.01, worst=10):
+        """Compare the replayed net worths against the stored company history."""
+        replayed = self.worth[self.stored_company, self.stored_at]
+        error = np.abs(replayed - self.stored_value)
+        mismatched = np.flatnonzero(error > tolerance)
+        companies, times = self.companies.inverse(), self.times.astype(datetime)
+        order = mismatched[np.argsort(-error[mismatched], kind='stable')][:worst]
+        return {
+            'rows': len(error),
+            'mismatches': len(mismatched),
+            'companies': len(set(self.stored_company[mismatched].tolist())),
+            'max_error': float(error.max()) if len(error) else 0.0,
+            'worst': [(companies[self.stored_company[i]], times[self.stored_at[i]], float(self.stored_value[i]), float(replayed[i])) for i in order]}
+
+    def curves(self):
+        """Yields (company, date, net worth) of every replayed evaluation."""
+        companies, times = self.companies.inverse(), self.times.astype(datetime)
+        for i, company in enumerate(companies):
+            for j, date in enumerate(times):
+                yield company, date, round(float(self.worth[i, j]), 2)
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded closes and transactions to rebuild company net worths offline.')
+    parser.add_argument('start', type=datetime.fromisoformat, help='first evaluation to replay, e.g. 2021-01-04')
+    parser.add_argument('end', type=datetime.fromisoformat, help='last evaluation to replay')
+    parser.add_argument('--starting-balance', type=float, default=STARTING_BALANCE)
+    parser.add_argument('--no-dividends', action='store_true', help='replay without dividend income')
+    parser.add_argument('--tolerance', type=float, default=0.01, help='largest difference from the stored history not reported')
+    parser.add_argument('--db-url', help='replay this database instead of the configured one')
+    parser.add_argument('--output', help='write the replayed curves as CSV to this file')
+    args = parser.parse_args()
+    if args.db_url:
+        interface.bind(args.db_url)
+
+    start = time_t.monotonic()
+    replay = Replay(args.start, args.end, starting_balance=args.starting_balance, dividends=not args.no_dividends)
+    with ReadDB() as db:
+        replay.load(db)
+    loaded = time_t.monotonic()
+    replay.run()
+    result = replay.diff(args.tolerance)
+    print(f"replay: {len(replay.companies)} companies, {len(replay.symbols)} symbols, {len(replay.times)} evaluations, "
+        f"{len(replay.trade_at)} transactions loaded in {loaded - start:.2f}s and replayed in {time_t.monotonic() - loaded:.2f}s")
+    if replay.unpriced:
+        print(f"replay: {replay.unpriced} symbols have no close in range and are valued at 0")
+    print(f"replay: {result['mismatches']} of {result['rows']} stored net worths differ by more than {args.tolerance} "
+        f"across {result['companies']} companies, max difference {result['max_error']:.2f}")
+    for company, date, stored, replayed in result['worst']:
+        print(f"  company {company} at {date:%Y-%m-%d %H:%M}: stored {stored:.2f}, replayed {replayed:.2f}")
+    if args.output:
+        with open(args.output, 'w', newline='') as file:
+            writer = csv.writer(file)
+            writer.writerow(['Company', 'Date', 'Net Worth'])
+            writer.writerows(replay.curves())
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+import re
+import time as time_t
+from datetime import datetime, time, timedelta
+from sqlalchemy import func
+from db.interface import DB
+from db.tables import CloseHistory, CompanyHistory, SymbolRollup, CompanyRollup
+from utils import config
+from utils.scheduler import market_time
+from .archive import get_archive
+
+DAILY = 'D'
+WEEKLY = 'W'
+HISTORY_POINTS = 20
+RANGE_DAYS = {'d': 1, 'w': 7, 'm': 30, 'y': 365}
+# ranges up to this long are read from raw rows, up to a year from daily rollups, beyond that from weekly ones
+RAW_SPAN = timedelta(days=7)
+DAILY_SPAN = timedelta(days=365)
+
+def local_now():
+    # history dates are stored as naive market times
+    return market_time().replace(tzinfo=None)
+
+def day_start(date):
+    return datetime.combine(date.date(), time())
+
+def week_start(date):
+    return day_start(date) - timedelta(days=date.weekday())
+
+def parse_range(text):
+    """Parse a range such as 3d, 2w, 6m or 1y into a timedelta. 'all' is None."""
+    if text.lower() == 'all':
+        return None
+    match = re.fullmatch(r'(\d*)([dwmy])', text.lower())
+    if not match:
+        raise ValueError(f"invalid range {text}")
+    return timedelta(days=int(match.group(1) or 1) * RANGE_DAYS[match.group(2)])
+
+def fold(bars, key, value, volume=None, high=None, low=None):
+    """Fold one observation into an [open, high, low, close, volume] bar."""
+    bar = bars.get(key)
+    if bar is None:
+        bars[key] = [value, high if high is not None else value, low if low is not None else value, value, volume or 0]
+    else:
+        bar[1] = max(bar[1], high if high is not None else value)
+        bar[2] = min(bar[2], low if low is not None else value)
+        bar[3] = value
+        bar[4] = volume or 0
+    return bars
+
+def downsample(series, points=HISTORY_POINTS):
+    """Keep the last point of each of `points` equal buckets."""
+    if len(series) <= points:
+        return series
+    step = len(series) / points
+    return [series[min(len(series) - 1, int((i + 1) * step) - 1)] for i in range(points)]
+
+class Rollups:
+    """Daily and weekly aggregates of the hourly history tables, and compaction of old raw rows."""
+    def __init__(self, retention_days=30):
+        self.retention_days = retention_days
+
+    def rollup(self):
+        start = time_t.monotonic()
+        # only complete days are rolled up
+        today = day_start(local_now())
+        with DB() as db:
+            symbol_days = self.roll_symbols(db, today)
+            company_days = self.roll_companies(db, today)
+            # release the write lock before compaction waits on the archive lock
+            db.commit()
+            compacted = self.compact(db, today)
+        print(f"rollups: {symbol_days} symbol days and {company_days} company days rolled up, {compacted} raw rows archived in {time_t.monotonic() - start:.2f}s")
+
+    def _since(self, db, rollup, raw_date):
+        last = db.query(func.max(rollup.start)).filter(rollup.period == DAILY).scalar()
+        if last:
+            return last + timedelta(days=1)
+        first = db.query(func.min(raw_date)).scalar()
+        return day_start(first) if first else None
+
+    def roll_symbols(self, db, today):
+        since = self._since(db, SymbolRollup, CloseHistory.date)
+        if since is None:
+            return 0
+        rows = db.query(CloseHistory.symbol, CloseHistory.date, CloseHistory.close, CloseHistory.volume)\
+            .filter(CloseHistory.date >= since).filter(CloseHistory.date < today)\
+            .order_by(CloseHistory.symbol, CloseHistory.date).yield_per(5000)
+        bars = {}
+        for symbol, date, close, volume in rows:
+            # close_history volume is the running volume of the day, so the day's volume is its last value
+            fold(bars, (symbol, day_start(date)), close, volume)
+        db.bulk_insert_mappings(SymbolRollup, [dict(symbol=symbol, period=DAILY, start=start, open=o, high=h, low=l, close=c, volume=v)
+            for (symbol, start), (o, h, l, c, v) in bars.items()])
+        # rebuild the weekly bars of every week that gained days
+        for week in {week_start(start) for _, start in bars}:
+            db.query(SymbolRollup).filter(SymbolRollup.period == WEEKLY).filter(SymbolRollup.start == week).delete(synchronize_session=False)
+            days = db.query(SymbolRollup.symbol, SymbolRollup.open, SymbolRollup.high, SymbolRollup.low, SymbolRollup.close, SymbolRollup.volume)\
+                .filter(SymbolRollup.period == DAILY).filter(SymbolRollup.start >= week).filter(SymbolRollup.start < week + timedelta(days=7))\
+                .order_by(SymbolRollup.symbol, SymbolRollup.start).all()
+            weekly = {}
+            volumes = {}
+            for symbol, o, h, l, c, v in days:
+                if symbol not in weekly:
+                    weekly[symbol] = [o, h, l, c, 0]
+                fold(weekly, symbol, c, high=h, low=l)
+                volumes[symbol] = volumes.get(symbol, 0) + (v or 0)
+            db.bulk_insert_mappings(SymbolRollup, [dict(symbol=symbol, period=WEEKLY, start=week, open=o, high=h, low=l, close=c, volume=volumes[symbol])
+                for symbol, (o, h, l, c, _) in weekly.items()])
+        return len(bars)
+
+    def roll_companies(self, db, today):
+        since = self._since(db, CompanyRollup, CompanyHistory.date)
+        if since is None:
+            return 0
+        rows = db.query(CompanyHistory.company, CompanyHistory.date, CompanyHistory.value)\
+            .filter(CompanyHistory.date >= since).filter(CompanyHistory.date < today)\
+            .order_by(CompanyHistory.company, CompanyHistory.date).yield_per(5000)
+        bars = {}
+        for company, date, value in rows:
+            fold(bars, (company, day_start(date)), value)
+        db.bulk_insert_mappings(CompanyRollup, [dict(company=company, period=DAILY, start=start, open=o, high=h, low=l, close=c)
+            for (company, start), (o, h, l, c, _) in bars.items()])
+        return len(bars)
+
+    def compact(self, db, today):
+        """Move raw rows older than the retention window into the archive. Everything before today has been rolled up."""
+        cutoff = min(today, day_start(local_now() - timedelta(days=self.retention_days)))
+        archive = get_archive()
+        return sum(archive.move(db, model, cutoff) for model in (CloseHistory, CompanyHistory))
+
+def _series(db, raw, rollup, key_column, rollup_key, key, span, weekly):
+    now = local_now()
+    since = now - span if span is not None else None
+    if span is not None and span <= RAW_SPAN:
+        query = db.query(raw[0], raw[1]).filter(key_column == key)
+        if since is not None:
+            query = query.filter(raw[0] >= since)
+        return query.order_by(raw[0]).all()
+    period = WEEKLY if weekly and (span is None or span > DAILY_SPAN) else DAILY
+    query = db.query(rollup.start, rollup.close).filter(rollup_key == key).filter(rollup.period == period)
+    if since is not None:
+        query = query.filter(rollup.start >= since)
+    series = query.order_by(rollup.start).all()
+    # today is not rolled up yet, so end on the latest raw value
+    latest = db.query(raw[0], raw[1]).filter(key_column == key).order_by(raw[0].desc()).first()
+    if latest and (not series or latest[0] > series[-1][0]):
+        series.append(latest)
+    return series
+
+def symbol_history(db, symbol, span, points=HISTORY_POINTS):
+    """Returns up to `points` (date, close) pairs of a symbol over the span, read from the cheapest level that covers it."""
+    series = _series(db, (CloseHistory.date, CloseHistory.close), SymbolRollup, CloseHistory.symbol, SymbolRollup.symbol, symbol, span, weekly=True)
+    return downsample(series, points)
+
+def company_history(db, company_id, span, points=HISTORY_POINTS):
+    """Returns up to `points` (date, net worth) pairs of a company over the span."""
+    series = _series(db, (CompanyHistory.date, CompanyHistory.value), CompanyRollup, CompanyHistory.company, CompanyRollup.company, company_id, span, weekly=False)
+    return downsample(series, points)
+
+def get_rollups():
+    return Rollups(retention_days=config.load('rollups', required=False).getint('retention_days', fallback=30))
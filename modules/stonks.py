@@ -1,14 +1,26 @@
 import discord
+import re
+import time as time_t
 from datetime import timedelta
 from discord.ext import commands
 from discord.ext.commands import errors
-from db.interface import DB
-from db.tables import User, Company, CompanyHistory, Symbol, CloseHistory
-from utils.scheduler import market_time, market_open_status, next_market_open
-from .iex import Iex
+from db.interface import DB, ReadDB
+from db.tables import User, Company, CompanyHistory, CloseHistory, Leaderboard
+from utils.scheduler import market_time, market_open_status, next_market_open, get_scheduler
+from utils import metrics
+from .iex import Iex, STARTING_BALANCE
+from .executor import get_executor, ExecutorBusy
+from .exchange import ExchangeError
+from .symbols import get_symbol_index
+from .orders import OrderEngine, Order, BUY, SELL, order_window, write_lock
+from .triggers import LIMIT, STOP, EXPIRY_DAYS
+from .rollups import parse_range, symbol_history, company_history, local_now
+from . import export as exports
+from .render import inv_table, daily_table, score_table
+from .cache import get_view_cache
 from tabulate import tabulate
-import pandas as pd
-import numpy as np
+
+SCORE_PAGE_SIZE = 10
 
 def name(user):
     return user.nick if hasattr(user, 'nick') else user.name
@@ -28,10 +40,16 @@ def timedelta_string(delta):
         strs.append(f"{s} seconds")
     return " ".join(strs)
 
+def rank_change(rank, previous_rank):
+    if rank is None or previous_rank is None or rank == previous_rank:
+        return ''
+    return f"⮝{previous_rank - rank}" if rank < previous_rank else f"⮟{rank - previous_rank}"
+
 class StonksError(errors.CommandError):
+    # the message, if any, is sent back to the channel by on_command_error
     pass
 
-# TODO: 
+# TODO:
 # limit company name length in printout
 # perhaps replace words like buy/sell with symbols?
 
@@ -39,106 +57,205 @@ class Stonks(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.iex = Iex()
-    
-    async def get_active_company(self, ctx, db, user):
-        uid = user.id
+        # blocking iex and database work runs here, never on the event loop
+        self.executor = get_executor()
+        self.symbols = get_symbol_index()
+        self.views = get_view_cache()
+        self.symbols.refresh()
+        # buys and sells are batched per symbol and filled at one price
+        self.order_engine = OrderEngine(self.executor, self.iex.price, self._fill, window=order_window(), check=self._check_order)
+
+    async def cog_before_invoke(self, ctx):
+        ctx.command_started = time_t.perf_counter()
+        metrics.current_command.set(ctx.command.name)
+
+    async def cog_after_invoke(self, ctx):
+        metrics.registry.observe('command_seconds', time_t.perf_counter() - ctx.command_started, command=ctx.command.name)
+
+    def get_active_company(self, db, uid):
         company = db.query(Company).filter(Company.owner == uid).filter(Company.active == True).first()
         if not company:
-            await ctx.send(f"You are not registered on the stonks market. Use $help register.")
-            raise StonksError()
+            raise StonksError(f"You are not registered on the stonks market. Use $help register.")
         return company
-    
-    async def market_open_check(self, ctx):
+
+    async def view(self, uid, name, compute):
+        """Serve a view of the active company from the view cache, or compute(uid) it on the executor."""
+        company_id = self.views.company(uid)
+        if company_id is not None:
+            cached = self.views.get(company_id, name)
+            if cached is not None:
+                return cached
+        return await self.executor.run(compute, uid)
+
+    def market_open_check(self):
         if not market_open_status():
-            await ctx.send(f"The market is closed. Please try again in {timedelta_string(next_market_open() - market_time())}.")
-            raise StonksError()
-    
-    async def stock_symbol_check(self, ctx, db, symbol):
-        if not db.query(Symbol).filter(Symbol.symbol == symbol).first():
-            await ctx.send(f"{symbol} is not a valid stock symbol.")
-            raise StonksError()
-    
-    async def get_latest_close(self, ctx, db, symbol):
+            raise StonksError(f"The market is closed. Please try again in {timedelta_string(next_market_open() - market_time())}.")
+
+    def stock_symbol_check(self, symbol):
+        if symbol not in self.symbols:
+            suggestions = self.symbols.suggest(symbol)
+            hint = f" Did you mean {', '.join(suggestions)}?" if suggestions else ""
+            raise StonksError(f"{symbol} is not a valid stock symbol.{hint}")
+
+    def get_latest_close(self, db, symbol):
         close_row = db.query(CloseHistory).filter(CloseHistory.symbol == symbol).order_by(CloseHistory.date.desc()).first()
         if not close_row:
-            close_row = self.iex.get_latest_close(db, symbol)
+            close_row = self.iex.get_latest_close(symbol)
             return close_row
         return close_row
-    
+
     @commands.command()
     async def time(self, ctx):
         """Return the current time for the game."""
         time = market_time()
         await ctx.send(f'It is currently {time.time().strftime("%H:%M:%S")} EDT for the market.')
-    
+
+    @commands.command()
+    async def search(self, ctx, *, text: str):
+        """Look up stock symbols by ticker or company name."""
+        matches = self.symbols.search(text)
+        if not matches:
+            await ctx.send(f"No stock symbols found for {text}.")
+            return
+        results = tabulate([[symbol, self.symbols.name(symbol)] for symbol in matches], headers=['Symbol', 'Name'])
+        await ctx.send(f"```{results}```")
+
     @commands.command()
     async def register(self, ctx, company_name: str):
         """Register a company under your username, joining the game.\nUse double quotation marks for names with multiple words or whitespace characters."""
-        author = ctx.author
-        uid = author.id
-        uname = name(author)
-        with DB() as db:
+        messages = await self.executor.run(self._register, ctx.author.id, name(ctx.author), company_name)
+        for message in messages:
+            await ctx.send(message)
+
+    def _register(self, uid, uname, company_name):
+        messages = []
+        # under the write lock, so an evaluation cannot take the dirty mark before the company is committed
+        with write_lock, DB() as db:
             if not db.query(User).filter(User.id == uid).first():
                 db.add(User(id=uid, credit_score=0))
-                await ctx.send(f'Welcome to the stonks market, {uname}. We have added you to our registry.')
-            
+                messages.append(f'Welcome to the stonks market, {uname}. We have added you to our registry.')
+
             active_company = db.query(Company).filter(Company.owner == uid).filter(Company.active == True).first()
             if active_company:
-                await ctx.send(f'You are already in ownership of the registered company {active_company.name}, {uname}.')
+                messages.append(f'You are already in ownership of the registered company {active_company.name}, {uname}.')
 
             else:
-                company = Company(owner=uid, name=company_name, balance=10000, active=True)
+                company = Company(owner=uid, name=company_name, balance=STARTING_BALANCE, active=True)
                 db.add(company)
                 db.flush()
-                db.add(CompanyHistory(company=company.id, date=market_time(), value=10000))
-                await ctx.send(f'Your application to register {company_name} has been accepted. Happy trading!')
-    
+                db.add(CompanyHistory(company=company.id, date=market_time(), value=STARTING_BALANCE))
+                db.add(Leaderboard(company=company.id, value=STARTING_BALANCE, date=market_time()))
+                self.iex.valuator.mark_dirty(company.id)
+                messages.append(f'Your application to register {company_name} has been accepted. Happy trading!')
+        return messages
+
     @commands.command()
     async def buy(self, ctx, quantity: int, symbol: str):
         """Buy shares of a stock at market price."""
         symbol = symbol.upper()
-        author = ctx.author
-        with DB() as db:
-            company = await self.get_active_company(ctx, db, author)
-            await self.market_open_check(ctx)
-            await self.stock_symbol_check(ctx, db, symbol)
-            
-            price = self.iex.price(symbol)
-            cost = quantity * price
-            if company.balance < cost:
-                await ctx.send(f"{company.name}\nBalance: {company.balance} USD\nPurchase cost: {cost} USD")
-                raise StonksError()
-
-            value = price * quantity
-            self.iex.buy(db, company.id, symbol, quantity, price)
-            await ctx.send(f"``-{value} {company.name} ⯮ {quantity} {symbol} @ {price}``")
+        self.stock_symbol_check(symbol)
+        await ctx.send(await self.order_engine.submit(Order(BUY, ctx.author.id, quantity, symbol)))
 
     @commands.command()
     async def sell(self, ctx, quantity: int, symbol: str):
         """Sell shares of a stock at market price."""
         symbol = symbol.upper()
-        author = ctx.author
+        if symbol not in self.symbols:
+            # delisted symbols drop out of the index, but can still be sold by their holders
+            await self.executor.run(self._held_symbol_check, ctx.author.id, symbol)
+        await ctx.send(await self.order_engine.submit(Order(SELL, ctx.author.id, quantity, symbol)))
+
+    def _held_symbol_check(self, uid, symbol):
+        with ReadDB() as db:
+            company = self.get_active_company(db, uid)
+            if self.iex.get_position(db, company.id, symbol) is None:
+                self.stock_symbol_check(symbol)
+
+    def _check_order(self, db, order):
+        """Reject market orders from unregistered players or outside market hours before a price is fetched."""
+        self.get_active_company(db, order.uid)
+        self.market_open_check()
+
+    def _fill(self, db, order, price):
+        """Fill a market order at the batch price, called by the order engine."""
+        company = self.get_active_company(db, order.uid)
+        self.market_open_check()
+        quantity, symbol = order.quantity, order.symbol
+        value = price * quantity
+
+        if order.side == BUY:
+            cost = quantity * price
+            if company.balance < cost:
+                raise StonksError(f"{company.name}\nBalance: {company.balance} USD\nPurchase cost: {cost} USD")
+            self.iex.buy(db, company.id, symbol, quantity, price)
+            return f"``-{value} {company.name} ⯮ {quantity} {symbol} @ {price}``"
+
+        inventory = self.iex.get_held_stock_quantity(db, company.id, symbol)
+        if inventory < quantity:
+            raise StonksError(f"``{company.name}\n{inventory} {symbol}``")
+        self.iex.sell(db, company.id, symbol, quantity, price)
+        return f"``+{value} {company.name} ⯬ {quantity} {symbol} @ {price}``"
+
+    @commands.command()
+    async def limit(self, ctx, side: str, quantity: int, symbol: str, price: float, days: int = EXPIRY_DAYS):
+        """Place an order that fills once the price reaches your limit, e.g. $limit buy 10 AAPL 120.\nOrders expire after 30 days unless given a number of days."""
+        await ctx.send(await self.place_order(ctx, LIMIT, side, quantity, symbol, price, days))
+
+    @commands.command()
+    async def stop(self, ctx, side: str, quantity: int, symbol: str, price: float, days: int = EXPIRY_DAYS):
+        """Place an order that fills once the price crosses your stop, e.g. $stop sell 10 AAPL 100.\nOrders expire after 30 days unless given a number of days."""
+        await ctx.send(await self.place_order(ctx, STOP, side, quantity, symbol, price, days))
+
+    async def place_order(self, ctx, kind, side, quantity, symbol, price, days):
+        side, symbol = side.lower(), symbol.upper()
+        if side not in (BUY, SELL) or quantity <= 0 or price <= 0 or days <= 0:
+            raise errors.BadArgument()
+        self.stock_symbol_check(symbol)
+        return await self.executor.run(self._place_order, ctx.author.id, kind, side, quantity, symbol, price, days)
+
+    def _place_order(self, uid, kind, side, quantity, symbol, price, days):
         with DB() as db:
-            company = await self.get_active_company(ctx, db, author)
-            await self.market_open_check(ctx)
-            await self.stock_symbol_check(ctx, db, symbol)
-            
-            inventory = self.iex.get_held_stock_quantity(db, company.id, symbol)
-            if inventory < quantity:
-                await ctx.send(f"``{company.name}\n{inventory} {symbol}``")
-                raise StonksError()
+            company = self.get_active_company(db, uid)
+            order = self.iex.book.place(db, company.id, side, kind, quantity, symbol, price, days)
+            return f"``#{order.id} {company.name} {kind} {side} {quantity} {symbol} @ {price} until {order.expires.strftime('%Y-%m-%d')}``"
+
+    @commands.command()
+    async def orders(self, ctx):
+        """List the open limit and stop orders of your company."""
+        await ctx.send(await self.executor.run(self._orders, ctx.author.id))
 
-            price = self.iex.price(symbol)
-            value = price * quantity
-            self.iex.sell(db, company.id, symbol, quantity, price)
-            await ctx.send(f"``+{value} {company.name} ⯬ {quantity} {symbol} @ {price}``")
+    def _orders(self, uid):
+        with ReadDB() as db:
+            company = self.get_active_company(db, uid)
+            orders = self.iex.book.open_orders(db, company.id)
+            if not orders:
+                return f"{company.name} has no open orders."
+            rows = [[o.id, o.kind, o.side, o.quantity, o.symbol, o.price, o.expires.strftime('%Y-%m-%d')] for o in orders]
+            table = tabulate(rows, headers=['#', 'Type', 'Side', 'Quantity', 'Symbol', 'Price', 'Expires'])
+            return f"```{table}```"
+
+    @commands.command()
+    async def cancel(self, ctx, order_id: int):
+        """Cancel one of your open limit or stop orders."""
+        await ctx.send(await self.executor.run(self._cancel, ctx.author.id, order_id))
+
+    def _cancel(self, uid, order_id):
+        # under the write lock, so a triggered fill of the same order cannot interleave
+        with write_lock, DB() as db:
+            company = self.get_active_company(db, uid)
+            if not self.iex.book.cancel(db, company.id, order_id):
+                raise StonksError(f"{company.name} has no open order #{order_id}.")
+            return f"Order #{order_id} cancelled."
 
     @commands.command()
     async def balance(self, ctx):
         """Check balance on your active company."""
-        author = ctx.author
-        with DB() as db:
-            company = await self.get_active_company(ctx, db, author)
+        await ctx.send(embed=await self.view(ctx.author.id, 'balance', self._balance))
+
+    def _balance(self, uid):
+        version = self.views.version()
+        with ReadDB() as db:
+            company = self.get_active_company(db, uid)
             history = db.query(CompanyHistory).filter(CompanyHistory.company == company.id).order_by(CompanyHistory.date.desc()).limit(2).all()
             net_worth = history[0].value
             delta = history[0].value - history[1].value if len(history) == 2 else 0
@@ -147,69 +264,161 @@ class Stonks(commands.Cog):
             embed = discord.Embed(title=f'{company.name}', description=f'{symbol}{round(percent, 2)}%', inline=True)
             embed.add_field(name='Cash Assets:', value=f'{round(company.balance, 2)} USD')
             embed.add_field(name='Net worth:', value=f'{round(net_worth, 2)} USD')
-            await ctx.send(embed=embed)
-    
+            self.views.put(uid, company.id, 'balance', embed, version)
+            return embed
+
     @commands.command()
     async def inv(self, ctx):
         """Simplified display of stocks owned by your current company."""
-        author = ctx.author
-        with DB() as db:
-            company = await self.get_active_company(ctx, db, author)
-            stock = self.iex.get_held_stocks(db, company.id)
+        await ctx.send(await self.view(ctx.author.id, 'inv', self._inv))
+
+    def _inv(self, uid):
+        version = self.views.version()
+        with ReadDB() as db:
+            company = self.get_active_company(db, uid)
             inventory = []
-            for s in stock:
-                close = await self.get_latest_close(ctx, db, s.symbol)
-                inventory.append([s.symbol, s.quantity, close.close * s.quantity])
-            inv_df = pd.DataFrame(inventory, columns=['Symbol', 'Quantity', 'Value'])
-            aggregated = tabulate(inv_df.groupby(['Symbol']).sum().reset_index(), headers=['Symbol', 'Quantity', 'Value'])
-            await ctx.send(f'```{aggregated}```')
+            for position in self.iex.get_positions(db, company.id):
+                close = self.get_latest_close(db, position.symbol)
+                inventory.append([position.symbol, position.quantity, close.close * position.quantity])
+            table = inv_table(inventory)
+            self.views.put(uid, company.id, 'inv', table, version)
+            return table
 
     @commands.command()
     async def daily(self, ctx):
-        # TODO: Asssess whether this can be cleaned up. 
+        # TODO: Asssess whether this can be cleaned up.
         #       As it stands, very similar to inv()
         """Detailed breakdown of stocks owned by your current company."""
-        author = ctx.author
-        with DB() as db:
-            company = await self.get_active_company(ctx, db, author)
+        await ctx.send(await self.view(ctx.author.id, 'daily', self._daily))
+
+    def _daily(self, uid):
+        version = self.views.version()
+        with ReadDB() as db:
+            company = self.get_active_company(db, uid)
             stock = self.iex.get_held_stocks(db, company.id)
             inventory = []
             for s in stock:
-                close = await self.get_latest_close(ctx, db, s.symbol)
-                inventory.append([s.symbol, s.quantity, s.purchase_price, close.close, s.quantity*close.close - s.quantity*s.purchase_price ]) 
-            inv_df = pd.DataFrame(inventory, columns=['Symbol', 'Quantity', 'Purchase Price', 'Close', 'Current Value'])
-            inv_df['sign'] = np.where(inv_df['Current Value']>=0, '+', '-')
-            inv_df['%'] = abs(((inv_df['Close'] - inv_df['Purchase Price'])  / inv_df['Purchase Price']) * 100)
-            inv_df['%'] = inv_df['%'].round(1)
-            inv_df = inv_df.sort_values(['Symbol'])
-            inv_df = inv_df[['sign', '%', 'Symbol', 'Quantity', 'Purchase Price', 'Close', 'Current Value']]
-            aggregated = tabulate(inv_df.values.tolist(), headers=['Δ', '%', 'Symbol', 'Quantity', 'Purchase Price', 'Close', 'Current Value'])
-            await ctx.send(f'```diff\n{aggregated}```')
-    
-    @commands.command()
-    async def score(self, ctx):
-        """Show the net worth of all active player companies."""
-        with DB() as db:
-            companies = db.query(Company).filter(Company.active == True).all()
+                close = self.get_latest_close(db, s.symbol)
+                inventory.append([s.symbol, s.quantity, s.purchase_price, close.close])
+            table = daily_table(inventory)
+            self.views.put(uid, company.id, 'daily', table, version)
+            return table
+
+    @commands.command()
+    async def score(self, ctx, page: int = 1):
+        """Show the net worth of all active player companies, ten per page."""
+        await ctx.send(await self.executor.run(self._score, max(page, 1)))
+
+    def _score(self, page):
+        with ReadDB() as db:
+            total = db.query(Leaderboard).count()
+            pages = max(1, -(-total // SCORE_PAGE_SIZE))
+            page = min(page, pages)
+            standings = db.query(Company.name, Leaderboard.value, Leaderboard.rank, Leaderboard.previous_rank)\
+                .join(Company, Company.id == Leaderboard.company)\
+                .order_by(Leaderboard.value.desc())\
+                .offset((page - 1) * SCORE_PAGE_SIZE).limit(SCORE_PAGE_SIZE).all()
             scores = []
-            for company in companies:
-                history = db.query(CompanyHistory).filter(CompanyHistory.company == company.id).order_by(CompanyHistory.date.desc()).first()
-                scores.append([company.name, round(history.value, 2)])
-            headers = ['Company', 'Net Worth']
-            score_df = pd.DataFrame(scores, columns=headers)
-            score_df = score_df.sort_values(['Net Worth'], ascending=False)
-            aggregated = tabulate(score_df.values.tolist(), headers=headers)
-            await ctx.send(f"```{aggregated}```")
+            for position, (company_name, value, rank, previous_rank) in enumerate(standings, (page - 1) * SCORE_PAGE_SIZE + 1):
+                scores.append([position, company_name, round(value, 2), rank_change(rank, previous_rank)])
+            return score_table(scores, page, pages)
+
+    @commands.command()
+    async def history(self, ctx, target: str = None, period: str = '1m'):
+        """Show the net worth of your company, or the history of another company or a stock symbol.\nThe range can be given as 3d, 2w, 6m, 1y or all, and defaults to 1m."""
+        # allow $history 1w for your own company. a number is required, since W, M, D and Y are tickers, as is ALL
+        if target is not None and period == '1m' and re.fullmatch(r'\d+[dwmy]|all', target.lower()) and target.upper() not in self.symbols:
+            target, period = None, target
+        try:
+            span = parse_range(period)
+        except ValueError:
+            raise errors.BadArgument()
+        await ctx.send(await self.executor.run(self._history, ctx.author.id, target, period, span))
+
+    def _history(self, uid, target, period, span):
+        with ReadDB() as db:
+            if target is None:
+                company = self.get_active_company(db, uid)
+                title, series = company.name, company_history(db, company.id, span)
+            elif target.upper() in self.symbols:
+                title, series = target.upper(), symbol_history(db, target.upper(), span)
+            else:
+                company = db.query(Company).filter(Company.name == target).filter(Company.active == True).first()
+                if not company:
+                    raise StonksError(f"{target} is not a registered company or stock symbol.")
+                title, series = company.name, company_history(db, company.id, span)
+        if not series:
+            return f"No history for {title} yet."
+        rows = [[date.strftime('%Y-%m-%d %H:%M'), round(value, 2)] for date, value in series]
+        table = tabulate(rows, headers=['Date', 'Value'])
+        return f"```{title} ({period})\n{table}```"
+
+    @commands.command()
+    async def export(self, ctx, kind: str = 'trades', period: str = 'all'):
+        """Export the trades or net worth history of your company as a CSV file.\nThe range can be given as 3d, 2w, 6m, 1y or all, and defaults to all."""
+        if kind.lower() not in ('trades', 'networth'):
+            raise errors.BadArgument()
+        try:
+            span = parse_range(period)
+        except ValueError:
+            raise errors.BadArgument()
+        name, file = await self.executor.run(self._export, ctx.author.id, kind.lower(), span)
+        with file:
+            await ctx.send(file=discord.File(file, filename=f"{name}-{kind.lower()}-{period}.csv"))
+
+    def _export(self, uid, kind, span):
+        since = local_now() - span if span is not None else None
+        with ReadDB() as db:
+            company = self.get_active_company(db, uid)
+            if kind == 'trades':
+                rows, headers = exports.trades(db, company.id, since), exports.TRADE_HEADERS
+            else:
+                rows, headers = exports.networth(db, company.id, since), exports.NETWORTH_HEADERS
+            try:
+                return company.name, exports.write_csv(rows, headers, max_bytes=exports.MAX_BYTES)
+            except ValueError:
+                raise StonksError("That export is too large to upload, try a shorter range.")
+
+    @commands.command()
+    @commands.is_owner()
+    async def stats(self, ctx):
+        """Show latency statistics for commands, IEX, the database and scheduled jobs."""
+        rows = []
+        for name, label in [('command_seconds', 'command'), ('iex_request_seconds', 'endpoint'), ('db_query_seconds', 'command'), ('job_seconds', 'job')]:
+            for labels, histogram in metrics.registry.snapshot(name):
+                rows.append([name.rsplit('_', 1)[0], labels[label], histogram.count,
+                    round(histogram.quantile(0.5) * 1000, 1), round(histogram.quantile(0.99) * 1000, 1), round(histogram.sum, 2)])
+        cache = self.iex.cache.stats()
+        views = self.views.stats()
+        exchange = self.iex.exchange.stats()
+        table = tabulate(rows, headers=['Metric', 'Name', 'Count', 'p50 ms', 'p99 ms', 'Total s'])
+        jobs = []
+        for job, runs in get_scheduler().history().items():
+            last = runs[-1] if runs else None
+            failed = sum(run['status'] in ('error', 'timeout') for run in runs)
+            jobs.append([job, len(runs), failed, last['status'] if last else '', f"{last['start']:%m-%d %H:%M}" if last else '', round(last['duration'], 2) if last else ''])
+        job_table = tabulate(jobs, headers=['Job', 'Runs', 'Failed', 'Last', 'Started UTC', 'Took s'])
+        await ctx.send(f"```{table}\n\n{job_table}\n\nQuote cache: {cache['hits']} hits, {cache['misses']} misses, {cache['size']} cached"
+            f"\nView cache: {views['hits']} hits, {views['misses']} misses, {views['size']} cached"
+            f"\nIEX credits: {exchange['spent']} of {exchange['budget'] or 'unlimited'} spent this month, {exchange['deferred']} deferred, {exchange['retried']} retried```")
 
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
         if isinstance(error, errors.UserInputError):
             await ctx.send_help(ctx.command)
-        elif isinstance(error, StonksError):
+        elif isinstance(error, errors.CheckFailure):
             pass
+        elif isinstance(error, StonksError):
+            if str(error):
+                await ctx.send(str(error))
+        elif isinstance(error, errors.CommandInvokeError) and isinstance(error.original, ExecutorBusy):
+            await ctx.send("The exchange is busy. Please try again shortly.")
+        elif isinstance(error, errors.CommandInvokeError) and isinstance(error.original, ExchangeError):
+            await ctx.send("The exchange is not responding right now. Please try again in a minute.")
+            print(f"{ctx.command}: {error.original}")
         else:
             await ctx.send("⚠")
             raise error
 
 def setup(bot):
-    bot.add_cog(Stonks(bot))
\ No newline at end of file
+    bot.add_cog(Stonks(bot))
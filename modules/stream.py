@@ -0,0 +1,161 @@
+import json
+import threading
+import time
+import requests
+from db.interface import DB
+from db.tables import CloseHistory, Position
+from utils import config
+from utils.scheduler import market_time
+from .cache import get_view_cache
+
+class PriceStream:
+    """Last-price table fed by an IEX SSE stream for the symbols in use.
+    Ticks are written to CloseHistory in batches rather than one row per tick."""
+    def __init__(self, url, token, flush_interval=60, max_age=60):
+        self.url = url
+        self.token = token
+        self.flush_interval = flush_interval
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        # symbol -> (price, volume, monotonic time of the tick)
+        self.prices = {}
+        self.pending = {}
+        self.symbols = frozenset()
+        self.listeners = []
+        self.session = requests.Session()
+        self.response = None
+        self.stopped = threading.Event()
+        self.threads = []
+
+    def start(self):
+        self.refresh_subscriptions()
+        for target in (self._read, self._flush_loop):
+            thread = threading.Thread(target=target, daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def stop(self):
+        self.stopped.set()
+        self._disconnect()
+        self.flush()
+
+    def subscribe(self, symbols):
+        """Change the subscribed symbols, reconnecting the feed if they differ."""
+        symbols = frozenset(symbols)
+        if symbols != self.symbols:
+            self.symbols = symbols
+            self._disconnect()
+
+    def refresh_subscriptions(self):
+        with DB() as db:
+            self.subscribe(s for (s,) in db.query(Position.symbol).distinct())
+
+    def add_listener(self, callback):
+        """callback(symbol, price) is called from the stream thread on every tick."""
+        self.listeners.append(callback)
+
+    def price(self, symbol):
+        """Returns the last streamed price, or None if the symbol has no fresh tick."""
+        tick = self.prices.get(symbol)
+        if tick and time.monotonic() - tick[2] < self.max_age:
+            return tick[0]
+        return None
+
+    def snapshot(self, symbols):
+        """Returns quote-like dicts for the symbols with fresh ticks."""
+        quotes = {}
+        now = time.monotonic()
+        with self.lock:
+            for symbol in symbols:
+                tick = self.prices.get(symbol)
+                if tick and now - tick[2] < self.max_age:
+                    quotes[symbol] = {'symbol': symbol, 'latestPrice': tick[0], 'latestVolume': tick[1]}
+        return quotes
+
+    def _disconnect(self):
+        response = self.response
+        if response is not None:
+            # unblocks the reader, which reconnects with the current symbols
+            response.close()
+
+    def _read(self):
+        backoff = 1
+        while not self.stopped.is_set():
+            symbols = self.symbols
+            if not symbols:
+                self.stopped.wait(1)
+                continue
+            try:
+                params = {'symbols': ','.join(sorted(symbols)), 'token': self.token}
+                with self.session.get(self.url, params=params, stream=True, timeout=(5, 60)) as response:
+                    response.raise_for_status()
+                    self.response = response
+                    backoff = 1
+                    for line in response.iter_lines(decode_unicode=True):
+                        if self.stopped.is_set() or symbols != self.symbols:
+                            break
+                        if line and line.startswith('data:'):
+                            self._on_data(json.loads(line[5:]))
+            except (requests.RequestException, ValueError, AttributeError) as e:
+                if self.stopped.is_set() or symbols != self.symbols:
+                    continue
+                print(f"stream: {type(e).__name__}: {e}, reconnecting in {backoff}s")
+                self.stopped.wait(backoff)
+                backoff = min(backoff * 2, 60)
+            finally:
+                self.response = None
+
+    def _on_data(self, quotes):
+        now = time.monotonic()
+        ticks = []
+        with self.lock:
+            for quote in quotes if isinstance(quotes, list) else [quotes]:
+                symbol, price = quote.get('symbol'), quote.get('latestPrice')
+                if symbol is None or price is None:
+                    continue
+                tick = (price, quote.get('latestVolume'), now)
+                self.prices[symbol] = tick
+                self.pending[symbol] = tick
+                ticks.append((symbol, price))
+        for callback in self.listeners:
+            for symbol, price in ticks:
+                callback(symbol, price)
+
+    def flush(self):
+        """Write the latest tick of every symbol since the last flush to CloseHistory."""
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        if pending:
+            now = market_time()
+            with DB() as db:
+                db.bulk_insert_mappings(CloseHistory, [dict(symbol=symbol, date=now, close=price, volume=volume)
+                    for symbol, (price, volume, _) in pending.items()])
+            # views show the latest closes
+            get_view_cache().clear()
+        return len(pending)
+
+    def _flush_loop(self):
+        while not self.stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+                self.refresh_subscriptions()
+            except Exception as e:
+                print(f"stream: flush failed, {type(e).__name__}: {e}")
+
+_price_stream = None
+_price_stream_lock = threading.Lock()
+
+def get_price_stream():
+    """Returns the shared price stream, or None when streaming is not enabled in config.ini."""
+    global _price_stream
+    with _price_stream_lock:
+        if _price_stream is None:
+            conf = config.load('stream', required=False)
+            if not conf.getboolean('enabled', fallback=False):
+                return None
+            _price_stream = PriceStream(
+                url=conf.get('url', fallback='https://cloud-sse.iexapis.com/stable/stocksUSNoUTP'),
+                token=config.load('iex').get('token'),
+                flush_interval=conf.getfloat('flush_interval', fallback=60),
+                max_age=conf.getfloat('max_age', fallback=60))
+        return _price_stream
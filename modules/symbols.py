@@ -0,0 +1,76 @@
+import difflib
+import threading
+from bisect import bisect_left
+from db.interface import DB
+from db.tables import Symbol
+
+class SymbolIndex:
+    """In-memory index of active symbols for validation and prefix search."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.symbols = set()
+        self.names = {}
+        # sorted (key, symbol) pairs, searched with bisect
+        self.tickers = []
+        self.lowered_names = []
+
+    def refresh(self, db=None):
+        """Reload the index from the symbols table."""
+        if db is None:
+            with DB() as db:
+                return self.refresh(db)
+        rows = db.query(Symbol.symbol, Symbol.name).filter(Symbol.active == True).all()
+        names = {symbol: name or '' for symbol, name in rows}
+        tickers = sorted((symbol, symbol) for symbol in names)
+        lowered_names = sorted((name.lower(), symbol) for symbol, name in names.items() if name)
+        # swap everything at once so readers never see a half built index
+        with self.lock:
+            self.symbols = set(names)
+            self.names = names
+            self.tickers = tickers
+            self.lowered_names = lowered_names
+
+    def __contains__(self, symbol):
+        return symbol in self.symbols
+
+    def name(self, symbol):
+        return self.names.get(symbol)
+
+    def _prefix(self, pairs, prefix, limit):
+        matches = []
+        i = bisect_left(pairs, (prefix,))
+        while i < len(pairs) and len(matches) < limit and pairs[i][0].startswith(prefix):
+            matches.append(pairs[i][1])
+            i += 1
+        return matches
+
+    def search(self, text, limit=10):
+        """Returns symbols whose ticker or company name starts with text, ticker matches first."""
+        with self.lock:
+            tickers, lowered_names = self.tickers, self.lowered_names
+        matches = self._prefix(tickers, text.upper(), limit)
+        for symbol in self._prefix(lowered_names, text.lower(), limit):
+            if len(matches) >= limit:
+                break
+            if symbol not in matches:
+                matches.append(symbol)
+        return matches
+
+    def suggest(self, symbol, limit=3):
+        """Returns likely intended symbols for a mistyped one."""
+        symbol = symbol.upper()
+        with self.lock:
+            tickers = self.tickers
+        # fuzzy match within the tickers sharing the first letter, which still catches transpositions
+        # after it such as TLSA, and fall back to every ticker when the first letter is the typo
+        bucket = self._prefix(tickers, symbol[:1], len(tickers))
+        matches = difflib.get_close_matches(symbol, bucket, n=limit, cutoff=0.5)
+        if not matches:
+            matches = difflib.get_close_matches(symbol, [ticker for ticker, _ in tickers], n=limit, cutoff=0.5)
+        return matches
+
+_symbol_index = SymbolIndex()
+
+def get_symbol_index():
+    """Returns the symbol index shared by the cog and the symbol sync job."""
+    return _symbol_index
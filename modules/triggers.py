@@ -0,0 +1,166 @@
+import heapq
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from sqlalchemy import event
+from db.interface import DB, ReadDB
+from db.tables import StandingOrder
+from utils.scheduler import market_time, market_open_status
+from .orders import BUY, write_lock
+
+LIMIT = 'limit'
+STOP = 'stop'
+EXPIRY_DAYS = 30
+
+def fires_below(side, kind):
+    """Limit buys and stop sells trigger when the price falls to their threshold, the others when it rises to it."""
+    return (side == BUY) == (kind == LIMIT)
+
+class TriggerBook:
+    """Per-symbol heaps of standing order thresholds, so a price update only touches the orders it crosses."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        # symbol -> heap of (-threshold, id), triggered when price <= threshold
+        self.below = {}
+        # symbol -> heap of (threshold, id), triggered when price >= threshold
+        self.above = {}
+        # cancelled orders are dropped from here and skipped lazily when popped
+        self.live = set()
+
+    def add(self, order_id, symbol, side, kind, price):
+        with self.lock:
+            if fires_below(side, kind):
+                heapq.heappush(self.below.setdefault(symbol, []), (-price, order_id))
+            else:
+                heapq.heappush(self.above.setdefault(symbol, []), (price, order_id))
+            self.live.add(order_id)
+
+    def remove(self, order_id):
+        with self.lock:
+            self.live.discard(order_id)
+
+    def symbols(self):
+        with self.lock:
+            return {symbol for heaps in (self.below, self.above) for symbol, heap in heaps.items() if heap}
+
+    def crossed(self, symbol, price):
+        """Pop and return the ids of the live orders whose threshold price has crossed."""
+        triggered = []
+        with self.lock:
+            below = self.below.get(symbol)
+            while below and -below[0][0] >= price:
+                triggered.append(heapq.heappop(below)[1])
+            above = self.above.get(symbol)
+            while above and above[0][0] <= price:
+                triggered.append(heapq.heappop(above)[1])
+            triggered = [order_id for order_id in triggered if order_id in self.live]
+            self.live.difference_update(triggered)
+        return triggered
+
+class OrderBook:
+    """Persistent limit and stop orders, executed through Iex.buy and Iex.sell once triggered."""
+    def __init__(self):
+        self.triggers = TriggerBook()
+        # triggered orders are filled off the caller's thread, one batch at a time
+        self.worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix='order-book')
+        self.iex = None
+
+    def load(self):
+        with DB() as db:
+            for order in db.query(StandingOrder).filter(StandingOrder.status == 'open'):
+                self.triggers.add(order.id, order.symbol, order.side, order.kind, order.price)
+
+    def place(self, db, company_id, side, kind, quantity, symbol, price, days=EXPIRY_DAYS):
+        now = market_time()
+        order = StandingOrder(company=company_id, symbol=symbol, side=side, kind=kind, quantity=quantity, price=price,
+            status='open', created=now, expires=now + timedelta(days=days))
+        db.add(order)
+        db.flush()
+        # only index the order once it is committed, so a fill triggered meanwhile can see it
+        order_id = order.id
+        event.listen(db, 'after_commit', lambda session: self.triggers.add(order_id, symbol, side, kind, price), once=True)
+        return order
+
+    def cancel(self, db, company_id, order_id):
+        """Cancel an open order of the company. Returns whether there was one."""
+        order = db.query(StandingOrder).filter(StandingOrder.id == order_id).filter(StandingOrder.company == company_id).filter(StandingOrder.status == 'open').first()
+        if not order:
+            return False
+        order.status = 'cancelled'
+        event.listen(db, 'after_commit', lambda session: self.triggers.remove(order_id), once=True)
+        return True
+
+    def open_orders(self, db, company_id):
+        return db.query(StandingOrder).filter(StandingOrder.company == company_id).filter(StandingOrder.status == 'open').order_by(StandingOrder.id).all()
+
+    def on_prices(self, prices):
+        """Check a symbol -> price map against the trigger index and queue the crossed orders for execution."""
+        if not market_open_status():
+            return
+        triggered = {}
+        for symbol, price in prices.items():
+            if price is not None:
+                for order_id in self.triggers.crossed(symbol, price):
+                    triggered[order_id] = price
+        if triggered:
+            self.worker.submit(self._execute, triggered)
+
+    def _execute(self, triggered):
+        if self.iex is None:
+            from .iex import Iex
+            self.iex = Iex()
+        try:
+            with write_lock, DB() as db:
+                orders = db.query(StandingOrder).filter(StandingOrder.id.in_(list(triggered))).filter(StandingOrder.status == 'open').order_by(StandingOrder.id).all()
+                for order in orders:
+                    self.fill(db, order, triggered[order.id])
+        except Exception as e:
+            print(f"order book: execution failed, {type(e).__name__}: {e}")
+            self._restore(triggered)
+
+    def _restore(self, order_ids):
+        """Put popped orders that are still open back into the trigger index."""
+        try:
+            with ReadDB() as db:
+                for order in db.query(StandingOrder).filter(StandingOrder.id.in_(list(order_ids))).filter(StandingOrder.status == 'open'):
+                    self.triggers.add(order.id, order.symbol, order.side, order.kind, order.price)
+        except Exception as e:
+            print(f"order book: could not restore {len(order_ids)} triggers, {type(e).__name__}: {e}")
+
+    def fill(self, db, order, price):
+        now = market_time()
+        company = self.iex.get_company(db, order.company)
+        if order.side == BUY:
+            ok = company.active and company.balance >= price * order.quantity
+        else:
+            ok = company.active and self.iex.get_held_stock_quantity(db, order.company, order.symbol) >= order.quantity
+        if ok and order.side == BUY:
+            self.iex.buy(db, order.company, order.symbol, order.quantity, price)
+        elif ok:
+            self.iex.sell(db, order.company, order.symbol, order.quantity, price)
+        order.status = 'filled' if ok else 'rejected'
+        order.fill_price = price if ok else None
+        order.filled = now
+
+    def expire(self):
+        """Expire open orders past their expiry date."""
+        with DB() as db:
+            expired = db.query(StandingOrder).filter(StandingOrder.status == 'open').filter(StandingOrder.expires < market_time()).all()
+            for order in expired:
+                order.status = 'expired'
+            expired = [order.id for order in expired]
+        for order_id in expired:
+            self.triggers.remove(order_id)
+        print(f"order book: {len(expired)} orders expired")
+
+_order_book = None
+_order_book_lock = threading.Lock()
+
+def get_order_book():
+    """Returns the order book shared by the cog and the exchange, loading open orders on first use."""
+    global _order_book
+    with _order_book_lock:
+        if _order_book is None:
+            _order_book = OrderBook()
+            _order_book.load()
+        return _order_book
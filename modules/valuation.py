@@ -0,0 +1,136 @@
+import threading
+from db.tables import Company, Position
+from utils import config
+from utils.lazy import lazy_import
+
+np = lazy_import('numpy')
+
+def load_holdings(db, companies=None):
+    """Returns the cash balances and {symbol: quantity} holdings of active companies, optionally only the given ones."""
+    balances = db.query(Company.id, Company.balance).filter(Company.active == True)
+    positions = db.query(Position.company, Position.symbol, Position.quantity).join(Company, Company.id == Position.company).filter(Company.active == True)
+    if companies is not None:
+        balances = balances.filter(Company.id.in_(companies))
+        positions = positions.filter(Position.company.in_(companies))
+    balances = dict(balances.all())
+    holdings = {company_id: {} for company_id in balances}
+    for company_id, symbol, quantity in positions:
+        holdings[company_id][symbol] = quantity
+    return balances, holdings
+
+def value_holdings(balances, holdings, prices):
+    """Value every company against a symbol -> price map in one vectorized pass."""
+    ids = list(balances)
+    values = np.array([balances[company_id] for company_id in ids], dtype=float)
+    rows, weights = [], []
+    for i, company_id in enumerate(ids):
+        for symbol, quantity in holdings.get(company_id, {}).items():
+            rows.append(i)
+            weights.append(quantity * prices.get(symbol, 0.0))
+    if rows:
+        values += np.bincount(np.array(rows, dtype=np.intp), weights=np.array(weights, dtype=float), minlength=len(values))
+    return {company_id: float(value) for company_id, value in zip(ids, values)}
+
+class Valuator:
+    """Incremental net worth evaluation.
+    Trades, dividends and splits mark their company dirty; dirty companies are reloaded from the database,
+    while the others only move by the price changes of the symbols they hold."""
+    def __init__(self, full_every=24):
+        self.full_every = full_every
+        self.lock = threading.Lock()
+        self.balances = {}
+        # company -> {symbol: quantity}, and the symbol -> companies index over it
+        self.holdings = {}
+        self.holders = {}
+        self.prices = {}
+        self.values = {}
+        self.dirty = set()
+        self.runs = 0
+        self.warm = False
+
+    def mark_dirty(self, company_id):
+        with self.lock:
+            self.dirty.add(company_id)
+
+    def invalidate(self):
+        """Force a full recompute on the next evaluation."""
+        with self.lock:
+            self.warm = False
+
+    def _index(self, company_id, holdings):
+        for symbol in self.holdings.get(company_id, {}):
+            self.holders.get(symbol, set()).discard(company_id)
+        self.holdings[company_id] = holdings
+        for symbol in holdings:
+            self.holders.setdefault(symbol, set()).add(company_id)
+
+    def evaluate(self, db, prices, full=False):
+        """Returns the net worth of every active company. prices must cover every held symbol."""
+        with self.lock:
+            dirty, self.dirty = self.dirty, set()
+            full = full or not self.warm or (self.full_every and self.runs % self.full_every == 0)
+            self.runs += 1
+            if full:
+                self._full(db, prices)
+            else:
+                self._incremental(db, prices, dirty)
+            return dict(self.values)
+
+    def _full(self, db, prices):
+        self.balances, holdings = load_holdings(db)
+        self.holdings, self.holders = {}, {}
+        for company_id, held in holdings.items():
+            self._index(company_id, held)
+        self.prices = dict(prices)
+        self.values = value_holdings(self.balances, self.holdings, self.prices)
+        self.warm = True
+
+    def _incremental(self, db, prices, dirty):
+        # carry unchanged companies forward, moving them by the price change of each symbol they hold
+        for symbol, price in prices.items():
+            old = self.prices.get(symbol)
+            self.prices[symbol] = price
+            if old is None or old == price:
+                continue
+            for company_id in self.holders.get(symbol, ()):
+                if company_id not in dirty:
+                    self.values[company_id] += self.holdings[company_id][symbol] * (price - old)
+        if dirty:
+            balances, holdings = load_holdings(db, dirty)
+            for company_id in dirty:
+                if company_id in balances:
+                    self.balances[company_id] = balances[company_id]
+                    self._index(company_id, holdings[company_id])
+                else:
+                    # no longer active
+                    self.balances.pop(company_id, None)
+                    self.values.pop(company_id, None)
+                    self._index(company_id, {})
+            self.values.update(value_holdings(balances, holdings, self.prices))
+
+    def check(self, db, tolerance=0.01):
+        """Compare the cached net worths against a full recompute at the same prices.
+        Returns {company: (incremental, full)} for every mismatch; companies awaiting reload are skipped."""
+        with self.lock:
+            balances, holdings = load_holdings(db)
+            expected = value_holdings(balances, holdings, self.prices)
+            mismatches = {}
+            for company_id in set(expected) | set(self.values):
+                if company_id in self.dirty:
+                    continue
+                cached, actual = self.values.get(company_id), expected.get(company_id)
+                if cached is None or actual is None or abs(cached - actual) > tolerance:
+                    mismatches[company_id] = (cached, actual)
+            return mismatches
+
+_valuator = None
+_valuator_lock = threading.Lock()
+
+def get_valuator():
+    """Returns the valuator shared by every Iex instance in this process."""
+    global _valuator
+    with _valuator_lock:
+        if _valuator is None:
+            conf = config.load('valuation', required=False)
+            _valuator = Valuator(full_every=conf.getint('full_every', fallback=24))
+        return _valuator
@@ -2,9 +2,16 @@ import configparser
 
 config_file = 'config.ini'
 
-def load(section:str):
-    """Returns a config section with the given name as a dictionary."""
+def load(section:str, required:bool=True):
+    """Returns a config section with the given name as a dictionary.
+    If the section is not required and missing, an empty section is returned so that fallbacks apply."""
     config = configparser.ConfigParser()
+    if not required:
+        # a missing file is fine too
+        config.read(config_file)
+        if not config.has_section(section):
+            return config[config.default_section]
+        return config[section]
     with open(config_file, 'r') as file: 
         config.read_file(file)
     return config[section]
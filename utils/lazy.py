@@ -0,0 +1,28 @@
+import importlib
+import threading
+
+class LazyModule:
+    """Stands in for a heavy module and imports it on first attribute access."""
+    def __init__(self, name):
+        object.__setattr__(self, '_name', name)
+        object.__setattr__(self, '_module', None)
+        object.__setattr__(self, '_lock', threading.Lock())
+
+    def _load(self):
+        if self._module is None:
+            with self._lock:
+                if self._module is None:
+                    object.__setattr__(self, '_module', importlib.import_module(self._name))
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._load(), attr)
+
+    def __setattr__(self, attr, value):
+        setattr(self._load(), attr, value)
+
+    def __repr__(self):
+        return f"<lazy module '{self._name}'{'' if self._module is None else ' (loaded)'}>"
+
+def lazy_import(name):
+    return LazyModule(name)
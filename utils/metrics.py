@@ -0,0 +1,129 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from utils import config
+
+# upper bounds in seconds, the last bucket is +Inf
+BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+# name of the command being served, so database time can be attributed to it
+current_command = contextvars.ContextVar('current_command', default=None)
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(BUCKETS, value)] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Approximate quantile, reported as the upper bound of the bucket it falls in."""
+        if not self.count:
+            return 0.0
+        target = q * self.count
+        seen = 0
+        for bound, count in zip(BUCKETS, self.counts):
+            seen += count
+            if seen >= target:
+                return min(bound, self.max)
+        return self.max
+
+class Registry:
+    """Process wide store of latency histograms and event counters, cheap enough to leave on in production."""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def count(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + 1
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def snapshot(self, name):
+        """Returns (labels, histogram) pairs recorded under name."""
+        with self.lock:
+            return [(dict(labels), histogram) for (key, labels), histogram in sorted(self.histograms.items()) if key == name]
+
+    def counts(self, name):
+        """Returns (labels, count) pairs recorded under name."""
+        with self.lock:
+            return [(dict(labels), count) for (key, labels), count in sorted(self.counters.items()) if key == name]
+
+    def render(self):
+        """Render every histogram and counter in the Prometheus text exposition format."""
+        lines = []
+        with self.lock:
+            items = sorted(self.histograms.items())
+            counters = sorted(self.counters.items())
+        typed = set()
+        for (name, labels), histogram in items:
+            metric = f'stonks_{name}'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} histogram')
+                typed.add(metric)
+            label_str = ','.join(f'{k}="{v}"' for k, v in labels)
+            cumulative = 0
+            for bound, count in zip(BUCKETS + ('+Inf',), histogram.counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f'{metric}_bucket{{{label_str + "," if label_str else ""}{le}}} {cumulative}')
+            lines.append(f'{metric}_sum{{{label_str}}} {histogram.sum}')
+            lines.append(f'{metric}_count{{{label_str}}} {histogram.count}')
+        for (name, labels), count in counters:
+            metric = f'stonks_{name}_total'
+            if metric not in typed:
+                lines.append(f'# TYPE {metric} counter')
+                typed.add(metric)
+            label_str = ','.join(f'{k}="{v}"' for k, v in labels)
+            lines.append(f'{metric}{{{label_str}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+registry = Registry()
+
+def instrument_engine(engine):
+    """Record the time of every SQL statement, attributed to the current command."""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        # kept on the statement's own context, so a statement that fails cannot leave a start time behind
+        context._query_start = time.perf_counter()
+
+    @event.listens_for(engine, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - context._query_start
+        registry.observe('db_query_seconds', elapsed, command=current_command.get() or 'background')
+
+def write_textfile(path=None):
+    """Atomically write all metrics to a Prometheus textfile collector file."""
+    path = path or config.load('metrics', required=False).get('textfile', fallback='stonks.prom')
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as file:
+        file.write(registry.render())
+    os.replace(tmp, path)
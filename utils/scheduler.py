@@ -1,8 +1,12 @@
 import sched
 import time as time_t
 import threading
+import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, date, time, timedelta
 from pytz import timezone
+from utils import metrics
 
 EDT = timezone('US/Eastern')
 UTC = timezone('UTC')
@@ -32,6 +36,10 @@ def next_market_close():
 def next_daily_data():
     return next_daily_event(DAILY_DATA, tz=UTC)
 
+def next_minute():
+    now = datetime.now(tz=UTC)
+    return now.replace(second=0, microsecond=0) + timedelta(minutes=1)
+
 def next_market_hour():
     if market_open_status() and (next_market_close() - market_time()).seconds > 3600:
         start = market_time()
@@ -39,10 +47,44 @@ def next_market_hour():
         start = next_market_open()
     return datetime.combine(start.date(), time(start.time().hour + 1), tzinfo=start.tzinfo)
 
+# overlap policies, for when a job is due while its previous run is still going
+SKIP = 'skip'
+COALESCE = 'coalesce'
+# catch up policies, for when the scheduler fires late after a stall
+RUN = 'run'
+HISTORY_SIZE = 50
+
+class Job:
+    def __init__(self, func, overlap=SKIP, timeout=None, catch_up=RUN, grace=300):
+        """overlap : SKIP drops a run while the previous one is going, COALESCE queues a single rerun
+        timeout : seconds after which a run is reported as timed out
+        catch_up : RUN runs a late event once (missed runs are collapsed), SKIP drops it
+        grace : seconds an event may be late before it counts as missed"""
+        self.func = func
+        self.name = getattr(func, '__name__', repr(func))
+        self.overlap = overlap
+        self.timeout = timeout
+        self.catch_up = catch_up
+        self.grace = grace
+        self.lock = threading.Lock()
+        self.running = False
+        self.pending = False
+        self.history = deque(maxlen=HISTORY_SIZE)
+
+    def record(self, status, start=None, duration=0.0):
+        self.history.append({'start': start or datetime.now(tz=UTC), 'duration': duration, 'status': status})
+        metrics.registry.count('job_runs', job=self.name, status=status)
+
+    def timed_out(self):
+        """Called by the watchdog while a run is still going past its timeout."""
+        print(f"scheduler: {self.name} exceeded its {self.timeout}s timeout")
+        metrics.registry.count('job_timeouts', job=self.name)
+
 class Scheduler:
-    def __init__(self):
+    def __init__(self, workers=4):
         self.scheduler = sched.scheduler(time_t.time, time_t.sleep)
         self.daemon = threading.Thread(target=self.scheduler.run, daemon=True)
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='scheduler')
         self.events = {}
 
     def start(self):
@@ -50,18 +92,78 @@ class Scheduler:
             self._schedule_event_group(time_func)
         self.daemon.start()
     
-    def schedule(self, event_func, time_func):
+    def schedule(self, event_func, time_func, **options):
         """Schedule a periodic event.
         event_func : target event
-        time_func : must return a datetime of next event"""
+        time_func : must return a datetime of next event
+        options : overlap, timeout, catch_up and grace, see Job"""
         if time_func not in self.events:
             self.events[time_func] = []
-        self.events[time_func].append(event_func)
+        self.events[time_func].append(Job(event_func, **options))
+
+    def history(self):
+        """Returns the recent runs of every job, by job name."""
+        return {job.name: list(job.history) for jobs in self.events.values() for job in jobs}
     
     def _schedule_event_group(self, time_func):
-        self.scheduler.enterabs(time_func().timestamp(), 0, self._run_event_group, [time_func])
+        due = time_func().timestamp()
+        self.scheduler.enterabs(due, 0, self._run_event_group, [time_func, due])
 
-    def _run_event_group(self, time_func):
+    def _run_event_group(self, time_func, due):
         self._schedule_event_group(time_func)
-        # run in separate worker thread
-        threading.Thread(target=lambda: [f() for f in self.events[time_func]], daemon=False).start()
+        late = time_t.time() - due
+        # jobs in a group are independent, so they run in parallel on the pool
+        for job in self.events[time_func]:
+            if late > job.grace and job.catch_up == SKIP:
+                job.record('missed')
+                continue
+            self._submit(job)
+
+    def _submit(self, job):
+        with job.lock:
+            if job.running:
+                if job.overlap == COALESCE:
+                    job.pending = True
+                job.record('coalesced' if job.overlap == COALESCE else 'skipped')
+                return
+            job.running = True
+        self.pool.submit(self._run_job, job)
+
+    def _run_job(self, job):
+        start = datetime.now(tz=UTC)
+        started = time_t.monotonic()
+        status = 'ok'
+        # threads cannot be interrupted, so a timeout is reported while the run carries on
+        watchdog = threading.Timer(job.timeout, job.timed_out) if job.timeout else None
+        if watchdog:
+            watchdog.daemon = True
+            watchdog.start()
+        try:
+            with metrics.registry.timer('job_seconds', job=job.name):
+                job.func()
+        except Exception:
+            status = 'error'
+            traceback.print_exc()
+        finally:
+            if watchdog:
+                watchdog.cancel()
+            duration = time_t.monotonic() - started
+            if status == 'ok' and job.timeout and duration > job.timeout:
+                status = 'timeout'
+            job.record(status, start, duration)
+            with job.lock:
+                job.running = False
+                rerun, job.pending = job.pending, False
+        if rerun:
+            self._submit(job)
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+def get_scheduler():
+    """Returns the scheduler of this process, so its job history can be inspected."""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = Scheduler()
+        return _scheduler